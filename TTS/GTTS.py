@@ -9,6 +9,8 @@ max_chars = 0
 class GTTS:
     def __init__(self):
         self.max_chars = 0
+        self.max_concurrent = 4  # requests in flight when synthesizing concurrently
+        self.requests_per_second = 4
         self.voices = []
 
     def run(self, text, filepath):
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
 from boto3 import Session
 from botocore.exceptions import BotoCoreError, ClientError, ProfileNotFound
+import json
 import sys
+from typing import List
+from xml.sax.saxutils import escape
 from utils import settings
+from utils.mp3 import split_mp3
 import random
 
 voices = [
@@ -25,52 +29,108 @@ voices = [
 
 
 class AWSPolly:
-    def __init__(self):
+    """Amazon Polly TTS.
+
+    Args:
+        client: A Polly client to use instead of one from the "polly" AWS profile, e.g. a stub of
+            the API for testing. The default client is created once, on first use.
+    """
+
+    def __init__(self, client=None):
         self.max_chars = 0
+        self.max_concurrent = 8  # requests in flight when synthesizing concurrently
+        self.requests_per_second = 8
+        self.voice_setting = "aws_polly_voice"  # key of the voice in settings.tts
+        self.batch_chars = 1500  # Polly allows 3000 billed characters per request
+        self.batch_size = 8
         self.voices = voices
+        self._client = client
 
-    def run(self, text, filepath, random_voice: bool = False):
-        try:
-            session = Session(profile_name="polly")
-            polly = session.client("polly")
-            if random_voice:
-                voice = self.randomvoice()
-            else:
-                if not settings.config["settings"]["tts"]["aws_polly_voice"]:
-                    raise ValueError(
-                        f"Please set the TOML variable AWS_VOICE to a valid voice. options are: {voices}"
-                    )
-                voice = str(settings.config["settings"]["tts"]["aws_polly_voice"]).capitalize()
+    @property
+    def client(self):
+        if self._client is None:
             try:
-                # Request speech synthesis
-                response = polly.synthesize_speech(
-                    Text=text, OutputFormat="mp3", VoiceId=voice, Engine="neural"
-                )
-            except (BotoCoreError, ClientError) as error:
-                # The service returned an error, exit gracefully
-                print(error)
-                sys.exit(-1)
-
-            # Access the audio stream from the response
-            if "AudioStream" in response:
-                file = open(filepath, "wb")
-                file.write(response["AudioStream"].read())
-                file.close()
-                # print_substep(f"Saved Text {idx} to MP3 files successfully.", style="bold green")
-
-            else:
-                # The response didn't contain audio data, exit gracefully
-                print("Could not stream audio")
-                sys.exit(-1)
-        except ProfileNotFound:
-            print("You need to install the AWS CLI and configure your profile")
-            print(
-                """
+                self._client = Session(profile_name="polly").client("polly")
+            except ProfileNotFound:
+                print("You need to install the AWS CLI and configure your profile")
+                print(
+                    """
             Linux: https://docs.aws.amazon.com/polly/latest/dg/setup-aws-cli.html
             Windows: https://docs.aws.amazon.com/polly/latest/dg/install-voice-plugin2.html
             """
+                )
+                sys.exit(-1)
+        return self._client
+
+    def get_voice(self, random_voice: bool = False) -> str:
+        if random_voice:
+            return self.randomvoice()
+        if not settings.config["settings"]["tts"]["aws_polly_voice"]:
+            raise ValueError(
+                f"Please set the TOML variable AWS_VOICE to a valid voice. options are: {voices}"
             )
+        return str(settings.config["settings"]["tts"]["aws_polly_voice"]).capitalize()
+
+    def synthesize_speech(self, **params) -> bytes:
+        try:
+            # Request speech synthesis
+            response = self.client.synthesize_speech(Engine="neural", **params)
+        except (BotoCoreError, ClientError) as error:
+            # The service returned an error, exit gracefully
+            print(error)
             sys.exit(-1)
 
+        # Access the audio stream from the response
+        if "AudioStream" not in response:
+            # The response didn't contain audio data, exit gracefully
+            print("Could not stream audio")
+            sys.exit(-1)
+        return response["AudioStream"].read()
+
+    def run(self, text, filepath, random_voice: bool = False):
+        audio = self.synthesize_speech(
+            Text=text, OutputFormat="mp3", VoiceId=self.get_voice(random_voice)
+        )
+        with open(filepath, "wb") as file:
+            file.write(audio)
+
+    def run_batch(self, texts: List[str], filepaths: List[str], random_voice: bool = False) -> List[float]:
+        """Synthesizes several texts with a single request and saves each one to its own file.
+
+        The texts are sent as one SSML document with a mark before each of them. The offsets of
+        the marks, requested as speech marks, tell where to split the mp3 (at frame boundaries,
+        without re-encoding).
+        Args:
+            texts (List[str]): The texts to synthesize
+            filepaths (List[str]): Where to save each of them
+
+        Returns:
+            List[float]: The duration of every saved file
+        """
+        voice = self.get_voice(random_voice)
+        ssml = "<speak>" + "".join(
+            f'<mark name="{i}"/>{escape(text)}<break time="300ms"/>' for i, text in enumerate(texts)
+        ) + "</speak>"
+        audio = self.synthesize_speech(Text=ssml, TextType="ssml", OutputFormat="mp3", VoiceId=voice)
+        marks = self.synthesize_speech(
+            Text=ssml, TextType="ssml", OutputFormat="json", SpeechMarkTypes=["ssml"], VoiceId=voice
+        )
+        starts = {}
+        for line in marks.decode("utf-8").splitlines():
+            if line.strip():
+                mark = json.loads(line)
+                starts[mark["value"]] = mark["time"] / 1000
+        if len(starts) != len(texts):
+            raise ValueError(f"Polly returned {len(starts)} speech marks for {len(texts)} texts")
+
+        durations = []
+        for (piece, duration), filepath in zip(
+            split_mp3(audio, [starts[str(i)] for i in range(len(texts))]), filepaths
+        ):
+            with open(filepath, "wb") as file:
+                file.write(piece)
+            durations.append(duration)
+        return durations
+
     def randomvoice(self):
         return random.choice(self.voices)
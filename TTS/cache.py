@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import Optional
+
+
+def _place(source: str, target: str):
+    """Hard links source to target, copying it if the filesystem doesn't support links."""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+class AudioCache:
+    """Content-addressed cache of synthesized audio with a disk budget and LRU eviction.
+
+    Every entry is {key}.mp3 plus {key}.json holding its duration. The modification time of the
+    json is bumped on every hit and entries are evicted oldest first once the budget is exceeded.
+    Entries are placed and stored by hard link, so callers must never write to a path in place
+    after it has been placed or stored (unlink it first).
+
+    Args:
+        directory (str): Where the entries are kept
+        max_bytes (int): Disk budget of the audio files
+    """
+
+    def __init__(self, directory: str = "assets/tts_cache", max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = None
+
+    @staticmethod
+    def key(provider: str, voice: str, lang: str, text: str) -> str:
+        return hashlib.sha256(json.dumps([provider, voice, lang, text]).encode("utf-8")).hexdigest()
+
+    def get(self, key: str, filepath: str) -> Optional[float]:
+        """Places the cached audio of key at filepath.
+
+        Returns:
+            Optional[float]: The duration of the audio, None on a miss
+        """
+        audio, meta = f"{self.directory}/{key}.mp3", f"{self.directory}/{key}.json"
+        try:
+            with open(meta, "r", encoding="utf-8") as raw_meta:
+                duration = json.load(raw_meta)["duration"]
+            _place(audio, filepath)
+            os.utime(meta)
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return duration
+
+    def put(self, key: str, filepath: str, duration: float):
+        """Stores the audio at filepath under key and evicts the least recently used entries."""
+        Path(self.directory).mkdir(parents=True, exist_ok=True)
+        audio, meta = f"{self.directory}/{key}.mp3", f"{self.directory}/{key}.json"
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        _place(filepath, audio + suffix)
+        os.replace(audio + suffix, audio)
+        with open(meta + suffix, "w", encoding="utf-8") as raw_meta:
+            json.dump({"duration": duration}, raw_meta)
+        os.replace(meta + suffix, meta)
+        with self._lock:
+            if self._size is None:
+                self._size = sum(
+                    entry.stat().st_size for entry in Path(self.directory).glob("*.mp3")
+                )
+            else:
+                self._size += os.path.getsize(audio)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = []
+        for meta in Path(self.directory).glob("*.json"):
+            try:
+                entries.append((meta.stat().st_mtime, meta, meta.with_suffix(".mp3")))
+            except FileNotFoundError:  # evicted by another process meanwhile
+                continue
+        for _, meta, audio in sorted(entries, key=lambda entry: entry[0]):
+            if self._size <= self.max_bytes:
+                break
+            try:
+                self._size -= audio.stat().st_size
+                audio.unlink()
+                meta.unlink()
+            except FileNotFoundError:
+                continue
@@ -1,18 +1,21 @@
 #!/usr/bin/env python3
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple
-import re
+from typing import Callable, Iterator, List, Optional, Tuple
 
 # import sox
 # from mutagen import MutagenError
 # from mutagen.mp3 import MP3, HeaderNotFoundError
-import translators as ts
 from rich.progress import track
-from moviepy.editor import AudioFileClip, CompositeAudioClip, concatenate_audioclips
 from utils.console import print_step, print_substep
-from utils.voice import sanitize_text
+from utils.voice import chunk_text, sanitize_text
 from utils import settings
 from utils.subreddit import shouldSkip
+from utils.ratelimit import get_rate_limiter
+from utils.translation import prefetch, translate
+from utils.speech_rate import SpeechRateRecorder, current_voice
+from utils.mp3 import audio_duration, join_mp3, write_manifest
+from TTS.cache import AudioCache
 
 
 DEFUALT_MAX_LENGTH: int = 35  # video length variable
@@ -44,6 +47,18 @@ class TTSEngine:
         self.path = path
         self.max_length = max_length
         self.length = 0
+        self.durations = {}  # clip filename -> duration, written to the manifest of path
+        self.rates = SpeechRateRecorder(current_voice())
+        self.limiter = get_rate_limiter(
+            type(self.tts_module).__name__,
+            getattr(self.tts_module, "max_concurrent", 1),
+            getattr(self.tts_module, "requests_per_second", 0),
+        )
+        try:
+            cache_size = settings.config["settings"]["tts"]["cache_size_mb"]
+        except KeyError:
+            cache_size = 512
+        self.cache = AudioCache(max_bytes=int(cache_size) * 1024 * 1024) if cache_size else None
 
     def run(self) -> Tuple[int, int]:
 
@@ -57,18 +72,45 @@ class TTSEngine:
         except OSError:
             pass
         print_step("Saving Text to MP3 files...")
+        self.prefetch_translations()
         self.call_tts("subreddit", self.reddit_object['subreddit'])
         idx = 0
         if 'type' in self.reddit_object.keys() and self.reddit_object['type'] == 'storymode':
-            for idx, item in track(enumerate(self.reddit_object['items']), "Saving..."):
-                if shouldSkip(item):
-                    continue
-                self.call_tts(f"title_{idx}", item["thread_title"])  # AYA: converts title to mp3, saves it, modified self.length to the length of that clip
-                # if item["thread_post"] != "":
-                #     self.call_tts(f"posttext_{idx}", item["thread_post"])
-                if self.length > self.max_length:
-                    break
+            items = self.reddit_object['items']
+            idx = max(len(items) - 1, 0)
+            titles = [
+                (i, f"title_{i}", item["thread_title"])
+                for i, item in enumerate(items)
+                if not shouldSkip(item)
+            ]
+            if hasattr(self.tts_module, "run_batch"):
+                units = [
+                    (batch[-1][0], lambda batch=batch: self.synthesize_batch(batch))
+                    for batch in self.pack(titles)
+                ]
+            else:
+                units = [
+                    (i, lambda i=i, filename=filename, text=text: [(i, self.synthesize(filename, text))])
+                    for i, filename, text in titles
+                ]
+            synthesized = self.dispatch(units)
+            try:
+                for _, results in track(synthesized, "Saving...", total=len(units)):
+                    for i, duration in results:
+                        self.length += duration  # AYA: converts title to mp3, saves it, modified self.length to the length of that clip
+                        # if item["thread_post"] != "":
+                        #     self.call_tts(f"posttext_{idx}", item["thread_post"])
+                        if self.length > self.max_length:
+                            idx = i
+                            break
+                    if self.length > self.max_length:
+                        break
+            finally:
+                synthesized.close()
             print_substep("Saved Text to MP3 files successfully.", style="bold green")
+            self.report_cache()
+            write_manifest(self.path, self.durations)
+            self.rates.save()
             return self.length, idx
 
         else:
@@ -84,71 +126,240 @@ class TTSEngine:
                 self.call_tts("posttext", self.reddit_object["thread_post"])
 
             idx = None
-            for idx, comment in track(enumerate(self.reddit_object["comments"]), "Saving..."):
-                # ! Stop creating mp3 files if the length is greater than max length.
-                if self.length > self.max_length:
-                    break
-                if (
-                    len(comment["comment_body"]) > self.tts_module.max_chars
-                ):  # Split the comment if it is too long
-                    self.split_post(comment["comment_body"], idx)  # Split the comment
-                else:  # If the comment is not too long, just call the tts engine
-                    self.call_tts(f"{idx}", comment["comment_body"])
+            units = [
+                (i, lambda comment=comment, i=i: self.synthesize_comment(comment["comment_body"], i))
+                for i, comment in enumerate(self.reddit_object["comments"])
+            ]
+            synthesized = self.dispatch(units)
+            try:
+                for idx, duration in track(synthesized, "Saving...", total=len(units)):
+                    # ! Stop creating mp3 files if the length is greater than max length.
+                    if self.length > self.max_length:
+                        break
+                    self.length += duration
+                else:  # every comment fits, as planned by get_subreddit_threads
+                    idx = len(units)
+            finally:
+                synthesized.close()
 
             print_substep("Saved Text to MP3 files successfully.", style="bold green")
+            self.report_cache()
+            write_manifest(self.path, self.durations)
+            self.rates.save()
             return self.length, idx
 
-    def split_post(self, text: str, idx: int):
-        split_files = []
-        split_text = [
-            x.group().strip()
-            for x in re.finditer(
-                r" *(((.|\n){0," + str(self.tts_module.max_chars) + "})(\.|.$))", text
+    def prefetch_translations(self, ignore="en"):
+        """Translates the subreddit, titles and post text of the object in one go, see utils.translation.
+
+        Comments are translated as they are synthesized, since most of them may never be.
+        """
+        lang = settings.config["reddit"]["thread"]["post_lang"]
+        if lang in ignore:
+            return
+        if self.reddit_object.get("type") == "storymode":
+            texts = [self.reddit_object["subreddit"]]
+            texts += [item["thread_title"] for item in self.reddit_object["items"] if not shouldSkip(item)]
+        else:
+            texts = [self.reddit_object["thread_subreddit"], self.reddit_object["thread_title"]]
+            if self.reddit_object["thread_post"] != "" and settings.config["settings"]["storymode"]:
+                texts.append(self.reddit_object["thread_post"])
+        prefetch(texts, lang)
+
+    def report_cache(self):
+        if self.cache is not None:
+            print_substep(
+                f"TTS cache: {self.cache.hits} hits, {self.cache.misses} misses.", style="bold blue"
             )
-        ]
-        offset = 0
-        for idy, text_cut in enumerate(split_text):
-            # print(f"{idx}-{idy}: {text_cut}\n")
-            if not text_cut or text_cut.isspace():
-                offset += 1
-                continue
 
-            self.call_tts(f"{idx}-{idy - offset}.part", text_cut)
-            split_files.append(AudioFileClip(f"{self.path}/{idx}-{idy - offset}.part.mp3"))
+    def dispatch(self, units: List[Tuple[int, Callable[[], float]]]) -> Iterator[Tuple[int, float]]:
+        """Runs synthesis units concurrently and yields their results in order.
 
-        CompositeAudioClip([concatenate_audioclips(split_files)]).write_audiofile(
-            f"{self.path}/{idx}.mp3", fps=44100, verbose=False, logger=None
-        )
+        At most max_concurrent units of the provider are dispatched ahead of the one being
+        consumed, so closing the generator once enough audio is committed stops dispatching and
+        wastes at most that many requests. Output filenames are fixed by each unit, so the result
+        doesn't depend on the order in which requests finish.
+        Args:
+            units (List[Tuple[int, Callable[[], float]]]): (index, function synthesizing it and returning its duration)
 
-        for i in split_files:
-            name = i.filename
-            i.close()
-            Path(name).unlink()
+        Yields:
+            Tuple[int, float]: The index of a unit and the duration of its audio, in order
+        """
+        try:
+            concurrent = settings.config["settings"]["tts"]["concurrent"]
+        except KeyError:
+            concurrent = True
+        window = self.limiter.max_concurrent if concurrent else 1
+        with ThreadPoolExecutor(max_workers=window) as pool:
+            in_flight = []
+            remaining = iter(units)
+            try:
+                for idx, unit in remaining:
+                    in_flight.append((idx, pool.submit(unit)))
+                    if len(in_flight) < window:
+                        continue
+                    idx, future = in_flight.pop(0)
+                    yield idx, future.result()
+                while in_flight:
+                    idx, future = in_flight.pop(0)
+                    yield idx, future.result()
+            finally:
+                for _, future in in_flight:
+                    future.cancel()
+
+    def synthesize_comment(self, text: str, idx: int) -> float:
+        text = translate_text(text)  # before splitting, so the whole comment is translated once
+        if self.tts_module.max_chars and len(text) > self.tts_module.max_chars:
+            return self.split_post(text, idx)  # Split the comment if it is too long
+        return self.synthesize(f"{idx}", text, translated=True)
 
-        # for i in range(0, idy + 1):
-        # print(f"Cleaning up {self.path}/{idx}-{i}.part.mp3")
+    def split_post(self, text: str, idx: int) -> float:
+        """Synthesizes a text longer than the provider's max_chars in chunks and joins them into {idx}.mp3.
 
-        # Path(f"{self.path}/{idx}-{i}.part.mp3").unlink()
+        text is expected to be translated already.
+        """
+        length = 0
+        split_files = []
+        for idy, text_cut in enumerate(chunk_text(text, self.tts_module.max_chars)):
+            # print(f"{idx}-{idy}: {text_cut}\n")
+            length += self.synthesize(f"{idx}-{idy}.part", text_cut, translated=True)
+            split_files.append(f"{idx}-{idy}.part.mp3")
+
+        streams = []
+        for name in split_files:
+            streams.append(Path(f"{self.path}/{name}").read_bytes())
+            Path(f"{self.path}/{name}").unlink()
+            self.durations.pop(name, None)
+        filepath = Path(f"{self.path}/{idx}.mp3")
+        filepath.unlink(missing_ok=True)
+        filepath.write_bytes(join_mp3(streams))
+        self.durations[f"{idx}.mp3"] = length
+        return length
 
     def call_tts(self, filename: str, text: str):
-        self.tts_module.run(text=process_text(text), filepath=f"{self.path}/{filename}.mp3")
+        self.length += self.synthesize(filename, text)
+
+    def synthesize(self, filename: str, text: str, translated: bool = False) -> float:
+        """Saves text to {path}/{filename}.mp3 within the provider's rate limit.
+
+        Doesn't touch self.length so it can run in any thread. The duration is recorded for the
+        manifest read by the render stage.
+        Returns:
+            float: The duration of the audio
+
+        Raises:
+            ValueError: The provider didn't produce readable audio
+        """
+        processed = process_text(text, translated=translated)
+        filepath, key, duration = self.lookup(filename, processed)
+        if duration is not None:
+            return duration
+        with self.limiter:
+            self.tts_module.run(text=processed, filepath=filepath)
         # try:
         #     self.length += MP3(f"{self.path}/{filename}.mp3").info.length
         # except (MutagenError, HeaderNotFoundError):
         #     self.length += sox.file_info.duration(f"{self.path}/{filename}.mp3")
-        try:
-            clip = AudioFileClip(f"{self.path}/{filename}.mp3")
-            self.length += clip.duration
-            clip.close()
-        except:
-            self.length = self.length
+        duration = audio_duration(filepath)
+        self.record(filename, processed, key, duration)
+        return duration
+
+    def pack(self, units: List[Tuple[int, str, str]]) -> List[List[Tuple[int, str, str]]]:
+        """Groups (index, filename, text) units into batches for the provider's run_batch.
+
+        A batch holds at most batch_size units and batch_chars characters, a longer unit gets a
+        batch of its own.
+        """
+        batches, chars = [], 0
+        for unit in units:
+            if (
+                not batches
+                or len(batches[-1]) >= self.tts_module.batch_size
+                or chars + len(unit[2]) > self.tts_module.batch_chars
+            ):
+                batches.append([])
+                chars = 0
+            batches[-1].append(unit)
+            chars += len(unit[2])
+        return batches
+
+    def synthesize_batch(self, batch: List[Tuple[int, str, str]]) -> List[Tuple[int, float]]:
+        """Saves the text of every (index, filename, text) unit with a single request, see pack.
+
+        Units found in the cache aren't sent. Doesn't touch self.length so it can run in any thread.
+        Returns:
+            List[Tuple[int, float]]: The index of every unit and the duration of its audio
+        """
+        durations, misses = {}, []
+        for i, filename, text in batch:
+            processed = process_text(text)
+            filepath, key, durations[i] = self.lookup(filename, processed)
+            if durations[i] is None:
+                misses.append((i, filename, processed, filepath, key))
+        if len(misses) == 1:  # a lone text isn't worth the speech marks request
+            i, filename, processed, filepath, key = misses[0]
+            with self.limiter:
+                self.tts_module.run(text=processed, filepath=filepath)
+            durations[i] = audio_duration(filepath)
+            self.record(filename, processed, key, durations[i])
+        elif misses:
+            with self.limiter:
+                synthesized = self.tts_module.run_batch(
+                    [processed for _, _, processed, _, _ in misses],
+                    [filepath for _, _, _, filepath, _ in misses],
+                )
+            for (i, filename, processed, _, key), duration in zip(misses, synthesized):
+                self.record(filename, processed, key, duration)
+                durations[i] = duration
+        return [(i, durations[i]) for i, _, _ in batch]
 
+    def lookup(self, filename: str, processed: str) -> Tuple[str, Optional[str], Optional[float]]:
+        """Prepares {path}/{filename}.mp3 for the processed text, taking it from the cache if possible.
 
-def process_text(text: str, ignore='en'):
+        Returns:
+            Tuple[str, Optional[str], Optional[float]]: The path, the cache key and the duration on a hit
+        """
+        filepath = f"{self.path}/{filename}.mp3"
+        # it may be a hard link into the cache, never write through it
+        Path(filepath).unlink(missing_ok=True)
+        key = self.cache_key(processed)
+        if key is not None:
+            duration = self.cache.get(key, filepath)
+            if duration is not None:
+                self.durations[f"{filename}.mp3"] = duration
+                self.rates.observe(processed, duration)
+                return filepath, key, duration
+        return filepath, key, None
+
+    def record(self, filename: str, processed: str, key: Optional[str], duration: float):
+        """Records the duration of a freshly synthesized clip for the manifest, speech rates and cache."""
+        self.durations[f"{filename}.mp3"] = duration
+        self.rates.observe(processed, duration)
+        if key is not None:
+            self.cache.put(key, f"{self.path}/{filename}.mp3", duration)
+
+    def cache_key(self, text: str):
+        """Returns the cache key of the processed text, None if it can't be cached.
+
+        Audio depends on the provider, its voice and the language. Providers declare the setting
+        holding their voice in voice_setting; a blank voice means a random one, which isn't cached.
+        """
+        if self.cache is None:
+            return None
+        voice_setting = getattr(self.tts_module, "voice_setting", None)
+        voice = settings.config["settings"]["tts"][voice_setting] if voice_setting else ""
+        if voice_setting and not voice:
+            return None
+        lang = settings.config["reddit"]["thread"]["post_lang"] or ""
+        return AudioCache.key(type(self.tts_module).__name__, str(voice), lang, text)
+
+
+def translate_text(text: str, ignore='en') -> str:
+    """Translates text to post_lang, unless it is one of ignore. Translations are shared by all stages."""
     lang = settings.config["reddit"]["thread"]["post_lang"]
-    new_text = sanitize_text(text)
     if lang not in ignore:
-        print_substep("Translating Text...")
-        translated_text = ts.google(text, to_language=lang)
-        new_text = sanitize_text(translated_text)
-    return new_text
+        return translate(text, lang)
+    return text
+
+
+def process_text(text: str, ignore='en', translated: bool = False):
+    return sanitize_text(text if translated else translate_text(text, ignore))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import hashlib
+import multiprocessing
+import os
+import shutil
+import subprocess
+from typing import List
+
+from utils import settings
+from utils.ffmpeg import run_ffmpeg
+
+SAMPLE_RATE = 22050
+CHARS_PER_SECOND = 15  # roughly the pace of the online voices
+MP3_OUTPUT = ["-ac", "1", "-codec:a", "libmp3lame", "-b:a", "64k"]
+
+
+class OfflineTTS:
+    """Synthesizes speech locally, so runs can be timed without network latency.
+
+    Uses espeak-ng with the voice in offline_voice. With no voice set, a tone is generated instead,
+    whose length follows the length of the text and whose pitch follows its content: the same text
+    always gives the same audio.
+    """
+
+    def __init__(self):
+        self.max_chars = 300
+        self.max_concurrent = multiprocessing.cpu_count()  # local processes, no rate limit
+        self.requests_per_second = 0
+        self.voice_setting = "offline_voice"  # key of the voice in settings.tts
+        self.voices = []
+
+    def run(self, text, filepath, random_voice: bool = False):
+        voice = settings.config["settings"]["tts"].get("offline_voice", "")
+        if not voice:
+            run_ffmpeg(self.tone(text) + MP3_OUTPUT + [filepath])
+            return
+        wav = f"{filepath}.wav"
+        try:
+            self.speak(text, voice, wav)
+            run_ffmpeg(["-i", wav] + MP3_OUTPUT + [filepath])
+        finally:
+            if os.path.exists(wav):
+                os.remove(wav)
+
+    @staticmethod
+    def speak(text: str, voice: str, wav: str):
+        binary = shutil.which("espeak-ng") or shutil.which("espeak")
+        if binary is None:
+            raise FileNotFoundError(
+                "espeak-ng was not found, install it or leave offline_voice blank to use a tone"
+            )
+        subprocess.run(
+            [binary, "-v", voice, "-w", wav, "--stdin"],
+            input=text,
+            text=True,
+            check=True,
+            stdout=subprocess.DEVNULL,
+        )
+
+    @staticmethod
+    def tone(text: str) -> List[str]:
+        """Returns the ffmpeg input and filter arguments generating the tone of text.
+
+        ffmpeg's lavfi sine source builds the samples, in its own process, so concurrent clips
+        don't contend for the GIL.
+        """
+        duration = max(len(text) / CHARS_PER_SECOND, 0.5)
+        frequency = 220 + int(hashlib.sha1(text.encode("utf-8")).hexdigest()[:4], 16) % 440
+        fade = 0.02  # seconds, so the clips don't click
+        return [
+            "-f",
+            "lavfi",
+            "-i",
+            f"sine=frequency={frequency}:sample_rate={SAMPLE_RATE}:duration={duration:.3f}",
+            "-af",
+            # the sine source peaks at 1/8 of full scale, 2.4 times that is the 0.3 used before
+            f"volume=2.4,afade=t=in:d={fade},afade=t=out:st={duration - fade:.3f}:d={fade}",
+        ]
+
+    def randomvoice(self):
+        return ""
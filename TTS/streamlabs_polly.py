@@ -1,8 +1,7 @@
 import random
-import requests
 from requests.exceptions import JSONDecodeError
 from utils import settings
-from utils.voice import check_ratelimit
+from utils.sessions import get_session, request_with_backoff
 
 voices = [
     "Brian",
@@ -30,6 +29,10 @@ class StreamlabsPolly:
     def __init__(self):
         self.url = "https://streamlabs.com/polly/speak"
         self.max_chars = 550
+        self.max_concurrent = 2  # requests in flight when synthesizing concurrently
+        self.requests_per_second = 1
+        self.voice_setting = "streamlabs_polly_voice"  # key of the voice in settings.tts
+        self.session = get_session("StreamlabsPolly", self.max_concurrent)
         self.voices = voices
 
     def run(self, text, filepath, random_voice: bool = False):
@@ -42,21 +45,19 @@ class StreamlabsPolly:
                 )
             voice = str(settings.config["settings"]["tts"]["streamlabs_polly_voice"]).capitalize()
         body = {"voice": voice, "text": text, "service": "polly"}
-        response = requests.post(self.url, data=body)
-        if not check_ratelimit(response):
-            self.run(text, filepath, random_voice)
-
-        else:
+        response = request_with_backoff(self.session, "POST", self.url, data=body)
+        if response.status_code == 429:
+            raise RuntimeError("Streamlabs Polly kept rate limiting, try again later.")
+        try:
+            voice_data = request_with_backoff(self.session, "GET", response.json()["speak_url"])
+            with open(filepath, "wb") as f:
+                f.write(voice_data.content)
+        except (KeyError, JSONDecodeError):
             try:
-                voice_data = requests.get(response.json()["speak_url"])
-                with open(filepath, "wb") as f:
-                    f.write(voice_data.content)
+                if response.json()["error"] == "No text specified!":
+                    raise ValueError("Please specify a text to convert to speech.")
             except (KeyError, JSONDecodeError):
-                try:
-                    if response.json()["error"] == "No text specified!":
-                        raise ValueError("Please specify a text to convert to speech.")
-                except (KeyError, JSONDecodeError):
-                    print("Error occurred calling Streamlabs Polly")
+                print("Error occurred calling Streamlabs Polly")
 
     def randomvoice(self):
         return random.choice(self.voices)
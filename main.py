@@ -12,9 +12,19 @@ from video_creation.background import (
     download_background,
     chop_background_video,
     get_background_config,
+    get_background_choice,
+)
+from utils.videos import release_part
+from video_creation.final_video import make_final_video
+from video_creation.pipeline import (
+    Stage,
+    prepare_background,
+    run_job,
+    run_jobs,
+    run_pipelined,
+    run_stages,
+    storymode_parts,
 )
-from utils.videos import get_part_num
-from video_creation.final_video import make_final_video, make_final_video_v2
 from video_creation.screenshot_downloader import download_screenshots_of_reddit_posts
 from video_creation.voices import save_text_to_mp3
 
@@ -41,36 +51,61 @@ print_step(f"You are using v{__VERSION__} of the bot")
 def main(POST_ID=None):
     cleanup()
     reddit_object = get_subreddit_threads(POST_ID)
-    length, number_of_comments = save_text_to_mp3(reddit_object)
-    length = math.ceil(length)
-    download_screenshots_of_reddit_posts(reddit_object, number_of_comments)
     bg_config = get_background_config()
-    download_background(bg_config)
-    chop_background_video(bg_config, length)
-    make_final_video(number_of_comments, length, reddit_object, bg_config)
+    run_stages(
+        [
+            Stage("tts", lambda _: save_text_to_mp3(reddit_object)),
+            Stage("background", lambda _: download_background(bg_config)),
+            # comment screenshots are only taken for the comments TTS made it to
+            Stage(
+                "screenshots",
+                lambda r: download_screenshots_of_reddit_posts(reddit_object, r["tts"][1]),
+                ["tts"],
+            ),
+            Stage(
+                "chop",
+                lambda r: chop_background_video(bg_config, math.ceil(r["tts"][0])),
+                ["tts", "background"],
+            ),
+            Stage(
+                "render",
+                lambda r: make_final_video(
+                    r["tts"][1], math.ceil(r["tts"][0]), reddit_object, bg_config
+                ),
+                ["screenshots", "chop"],
+            ),
+        ]
+    )
 
 
 from time import sleep
 def my_main():
-    for i in range(config["settings"]["times_to_run"]):
+    settings.config["settings"]["storymode"] = True
+    if settings.config["settings"]["workers"] > 1:
+        run_jobs(config["settings"]["times_to_run"], settings.config["settings"]["workers"])
+        return
+    if settings.config["settings"]["pipeline_depth"] > 0:
+        run_pipelined(config["settings"]["times_to_run"], settings.config["settings"]["pipeline_depth"])
+        return
+    for i, (subreddit, part, reddit_object) in enumerate(
+        storymode_parts(config["settings"]["times_to_run"])
+    ):
         try:
-            cleanup()
-            settings.config["settings"]["storymode"] = True
-            subreddit = settings.config["reddit"]["thread"]["subreddit"]
-            part = get_part_num(subreddit) + 1
             # postids = settings.config["reddit"]["thread"]["post_id"].split("+")
             # post_ids = "ivsw47,k4stku,lxt9ld".split(",")
-            reddit_object = get_subreddit_threads(None, part=str(part), post_type="top", time_filter='year')
-            length, number_of_posts = save_text_to_mp3(reddit_object)
-            length = math.ceil(length)
-            download_screenshots_of_reddit_posts(reddit_object, number_of_posts)
-            bg_config = get_background_config()
-            chop_background_video(bg_config, length)
-            make_final_video_v2(number_of_posts + 1, length, reddit_object, bg_config)
+            if reddit_object is None:
+                reddit_object = get_subreddit_threads(
+                    None, part=str(part), post_type="top", time_filter="year"
+                )
+            background_choice = get_background_choice()
+            prepare_background(background_choice)
+            run_job(reddit_object, background_choice)
         except Exception as e:
             print_step(f"ERROR AT ITERATION {i}")
             print(e)
             sleep(60)
+        finally:
+            release_part(subreddit, part)  # no-op once the part is done, see utils.history
 
 
 
@@ -0,0 +1,110 @@
+import asyncio
+import re
+from typing import Iterator, List
+
+import asyncpraw
+
+from reddit import backlog
+from reddit.client import USER_AGENT
+from reddit.subreddit import plan_storymode, storymode_contents
+from utils import settings
+from utils.console import print_step, print_substep
+from utils.ratelimit import AsyncRateLimiter
+from utils.subreddit import MIN_REMAINING
+from utils.videos import allocate_part, release_part
+
+MAX_CONCURRENT = 4  # listing requests in flight
+REQUESTS_PER_SECOND = 1.5  # reddit allows 100 requests per minute per OAuth client
+
+
+def configured_subreddits() -> List[str]:
+    """Returns the subreddits of reddit.thread.subreddit, e.g. "AskReddit+r/tifu" -> ["AskReddit", "tifu"]."""
+    return [
+        re.sub(r"^r/", "", name.strip(), flags=re.IGNORECASE)
+        for name in str(settings.config["reddit"]["thread"]["subreddit"]).split("+")
+        if name.strip()
+    ]
+
+
+async def _refill(reddit, limiter: AsyncRateLimiter, sub: str, post_type: str, time_filter: str):
+    subreddit = await reddit.subreddit(sub)
+    pages = 0
+    while pages < backlog.MAX_PAGES and backlog.needs_refill(sub):
+        pending = next(backlog.pending_listings(sub, post_type, time_filter), None)
+        if pending is None:  # every listing is exhausted
+            return
+        listing, after = pending
+        async with limiter:
+            submissions = [
+                submission async for submission in backlog.fetch_page(subreddit, listing, after)
+            ]
+        limits = reddit.auth.limits
+        limiter.observe(limits.get("remaining"), limits.get("reset_timestamp"))
+        backlog.store_page(sub, listing, after, submissions)
+        pages += 1
+
+
+async def _refill_all(subreddits: List[str], post_type: str, time_filter: str):
+    creds = settings.config["reddit"]["creds"]
+    limiter = AsyncRateLimiter(MAX_CONCURRENT, REQUESTS_PER_SECOND, MIN_REMAINING)
+    # listings of public subreddits need no user, so the client is read-only and never asks for 2FA
+    async with asyncpraw.Reddit(
+        client_id=creds["client_id"], client_secret=creds["client_secret"], user_agent=USER_AGENT
+    ) as reddit:
+        results = await asyncio.gather(
+            *(_refill(reddit, limiter, sub, post_type, time_filter) for sub in subreddits),
+            return_exceptions=True,
+        )
+    for sub, result in zip(subreddits, results):
+        if isinstance(result, Exception):
+            print_substep(f"Couldn't refill the backlog of r/{sub}: {result}", style="bold red")
+
+
+def fetch_storymode_parts(
+    subreddits: List[str], post_type: str = "top", time_filter: str = "year"
+) -> List[dict]:
+    """Fetches the next storymode part of every subreddit, the listings of all of them concurrently.
+
+    Only the backlogs that run low are refilled (see reddit/backlog.py), through one read-only
+    asyncpraw client whose requests share a rate limiter. Every part number is allocated from its
+    own subreddit's counter, the part is planned and its threads claimed as get_subreddit_threads
+    does, so the contents are the same.
+    Args:
+        subreddits (List[str]): Names of the subreddits, without r/
+
+    Returns:
+        List[dict]: The contents of the parts, in the order of subreddits, leaving out subreddits
+            without threads left
+    """
+    print_step(f"Getting threads of {len(subreddits)} subreddits...")
+    asyncio.run(_refill_all(subreddits, post_type, time_filter))
+    parts = []
+    for sub in subreddits:
+        part = allocate_part(sub)
+        contents = storymode_contents(sub, str(part))
+        contents["items"] = backlog.take(None, sub, backlog.TAKE)
+        if not contents["items"]:
+            release_part(sub, part)
+            print_substep(f"[STORYMODE] r/{sub} has no threads left.", style="bold red")
+            continue
+        plan_storymode(contents, sub)
+        parts.append(contents)
+    return parts
+
+
+def iter_storymode_parts(
+    subreddits: List[str], times: int, post_type: str = "top", time_filter: str = "year"
+) -> Iterator[dict]:
+    """Yields times storymode parts, taking turns between the subreddits and fetching a round of them at once.
+
+    Subreddits without threads left drop out of the rotation; stops early once none is left.
+    """
+    active, made = list(subreddits), 0
+    while made < times and active:
+        fetched = active[: times - made]
+        parts = fetch_storymode_parts(fetched, post_type, time_filter)
+        exhausted = set(fetched) - {contents["thread_subreddit"] for contents in parts}
+        active = [sub for sub in active if sub not in exhausted]
+        for contents in parts:
+            yield contents
+            made += 1
@@ -0,0 +1,182 @@
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from utils import history
+from utils.console import print_substep
+
+PAGE = 100  # the most reddit returns per listing request
+LOW_WATER = 50  # refill once fewer candidates than this are left
+TAKE = 50  # candidates a part is planned from
+MAX_PAGES = 5  # listing pages one take may fetch, e.g. while paging past threads already used
+REFRESH_AFTER = 24 * 60 * 60  # seconds before an exhausted listing is crawled from the start again
+
+
+def _listing_chain(post_type: str, time_filter: str) -> List[str]:
+    """The listings a subreddit's backlog is refilled from, in order, starting with the asked one."""
+    chain = [f"top:{time_filter}", "hot", f"controversial:{time_filter}"]
+    first = {"hot": "hot", "controversial": f"controversial:{time_filter}"}.get(post_type, chain[0])
+    return [first] + [listing for listing in chain if listing != first]
+
+
+def fetch_page(subreddit, listing: str, after: Optional[str]):
+    """Returns the page of the listing after the cursor: an iterator for a praw subreddit, an async
+    one for an asyncpraw subreddit."""
+    name, _, time_filter = listing.partition(":")
+    params = {"after": after} if after else {}
+    if name == "top":
+        return subreddit.top(time_filter=time_filter, limit=PAGE, params=params)
+    if name == "controversial":
+        return subreddit.controversial(time_filter=time_filter, limit=PAGE, params=params)
+    return subreddit.hot(limit=PAGE, params=params)
+
+
+def available(sub: str) -> int:
+    """Number of candidates of the subreddit that are neither used nor claimed by a part in progress."""
+    (count,) = (
+        history.connect()
+        .execute(f"SELECT COUNT(*) FROM candidates c WHERE {_available_sql()}", (sub, sub))
+        .fetchone()
+    )
+    return count
+
+
+def _available_sql() -> str:
+    # a claim only holds while its part is allocated by a live process (see
+    # history.live_allocation): released or abandoned parts free their threads and done parts
+    # have them in used_threads
+    return f"""
+    c.subreddit = ?
+    AND NOT EXISTS (SELECT 1 FROM used_threads u WHERE u.thread_id = c.thread_id AND u.kind = 'story')
+    AND (c.claimed_part IS NULL OR NOT EXISTS (
+        SELECT 1 FROM parts p WHERE p.subreddit = ? AND p.part = c.claimed_part
+        AND {history.live_allocation()}
+    ))
+"""
+
+
+def pending_listings(
+    sub: str, post_type: str = "top", time_filter: str = "year"
+) -> Iterator[Tuple[str, Optional[str]]]:
+    """Yields the listings of the chain that aren't exhausted, with the cursor to fetch their next page after.
+
+    Exhausted listings are crawled again from the start after REFRESH_AFTER.
+    """
+    connection = history.connect()
+    for listing in _listing_chain(post_type, time_filter):
+        row = connection.execute(
+            "SELECT after, exhausted, updated FROM listing_cursors WHERE subreddit = ? AND listing = ?",
+            (sub, listing),
+        ).fetchone()
+        after, exhausted, updated = row or (None, 0, 0)
+        if exhausted and time.time() - updated < REFRESH_AFTER:
+            continue
+        yield listing, None if exhausted else after
+
+
+def store_page(sub: str, listing: str, after: Optional[str], submissions: list) -> int:
+    """Adds a fetched page of a listing to the backlog and moves the listing's cursor past it.
+
+    Args:
+        sub (str): Name of the subreddit the backlog is kept under
+        listing (str): The listing the page is of, as yielded by pending_listings
+        after (str): The cursor the page was fetched after
+        submissions (list): The submissions of the page, praw or asyncpraw ones
+
+    Returns:
+        int: How many candidates became available, leaving out threads already used or in the backlog
+    """
+    now = int(time.time())
+    with history.transaction() as cursor:
+        before = available(sub)
+        cursor.executemany(
+            "INSERT OR IGNORE INTO candidates (subreddit, thread_id, title, selftext, url, fetched)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (sub, s.id, s.title, s.selftext, f"https://reddit.com{s.permalink}", now)
+                for s in submissions
+            ],
+        )
+        added = available(sub) - before
+        cursor.execute(
+            "INSERT OR REPLACE INTO listing_cursors (subreddit, listing, after, exhausted, updated)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                sub,
+                listing,
+                submissions[-1].fullname if submissions else after,
+                int(len(submissions) < PAGE),
+                now,
+            ),
+        )
+    print_substep(f"Backlog of r/{sub}: {added} new candidates from {listing}.", style="bold blue")
+    return added
+
+
+def needs_refill(sub: str, count: int = TAKE) -> bool:
+    return available(sub) < max(count, LOW_WATER)
+
+
+def refill(subreddit, sub: str, post_type: str = "top", time_filter: str = "year") -> Optional[int]:
+    """Adds the next page of the first listing of the chain that isn't exhausted to the backlog.
+
+    Every listing is paginated from where the previous refill left it, so no post is fetched twice.
+    Args:
+        subreddit (praw.models.Subreddit): The subreddit to crawl
+        sub (str): Name of the subreddit the backlog is kept under
+
+    Returns:
+        Optional[int]: How many candidates became available, None if every listing is exhausted
+    """
+    pending = next(pending_listings(sub, post_type, time_filter), None)
+    if pending is None:
+        return None
+    listing, after = pending
+    return store_page(sub, listing, after, list(fetch_page(subreddit, listing, after)))
+
+
+def take(
+    subreddit, sub: str, count: int, post_type: str = "top", time_filter: str = "year"
+) -> List[dict]:
+    """Returns up to count available candidates, best ranked first, refilling the backlog if it runs low.
+
+    The candidates aren't claimed, see claim.
+    Args:
+        subreddit (praw.models.Subreddit): The subreddit to refill from, None to not refill it here
+            because reddit/async_fetch.py already did
+
+    Returns:
+        List[dict]: thread_id, thread_subreddit, thread_url, thread_title and thread_post of each
+    """
+    pages = 0
+    while subreddit is not None and pages < MAX_PAGES and needs_refill(sub, count):
+        if refill(subreddit, sub, post_type, time_filter) is None:
+            break
+        pages += 1
+    rows = (
+        history.connect()
+        .execute(
+            f"SELECT thread_id, url, title, selftext FROM candidates c WHERE {_available_sql()}"
+            " ORDER BY rowid LIMIT ?",
+            (sub, sub, count),
+        )
+        .fetchall()
+    )
+    return [
+        {
+            "thread_id": thread_id,
+            "thread_subreddit": sub,
+            "thread_url": url,
+            "thread_title": title,
+            "thread_post": selftext,
+        }
+        for thread_id, url, title, selftext in rows
+    ]
+
+
+def claim(sub: str, part: int, thread_ids: List[str]):
+    """Reserves the threads for an allocated part, so other parts aren't handed them while it's made."""
+    with history.transaction() as cursor:
+        cursor.executemany(
+            "UPDATE candidates SET claimed_part = ? WHERE subreddit = ? AND thread_id = ?",
+            [(part, sub, thread_id) for thread_id in thread_ids],
+        )
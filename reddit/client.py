@@ -0,0 +1,94 @@
+import hashlib
+import os
+import sys
+import threading
+
+import praw
+from praw.util.token_manager import FileTokenManager
+
+from utils import settings
+from utils.console import print_substep
+
+TOKEN_FILE = "./video_creation/data/reddit_refresh_token"
+# sha256 of the reddit.creds.refresh_token last written to TOKEN_FILE
+TOKEN_SEED_FILE = TOKEN_FILE + ".config"
+USER_AGENT = "Accessing Reddit threads"
+
+_reddit = None
+_reddit_lock = threading.Lock()
+
+
+def get_reddit() -> praw.Reddit:
+    """Returns the Reddit client of this process, authenticating it on first use.
+
+    With a refresh token (reddit.creds.refresh_token, then kept in TOKEN_FILE) the client never
+    sends the password, survives restarts and doesn't need a 2FA code. Otherwise it logs in with
+    the password once per process; praw renews the access token on its own when it expires.
+
+    Raises:
+        RuntimeError: 2FA is on, there's no refresh token and no terminal to ask the code on,
+            e.g. an unattended batch run
+    """
+    global _reddit
+    with _reddit_lock:
+        if _reddit is None:
+            _reddit = _authenticate()
+        return _reddit
+
+
+def _seed_token_file(refresh_token: str):
+    """Writes the configured refresh token to TOKEN_FILE, unless it's the one written last time.
+
+    TOKEN_FILE then holds whatever token Reddit rotated it to, which must be kept. A token that
+    differs from the last one written from the config replaces it, e.g. one the user renewed.
+    """
+    fingerprint = hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()
+    try:
+        with open(TOKEN_SEED_FILE, "r", encoding="utf-8") as raw_seed:
+            seeded = raw_seed.read().strip()
+    except OSError:
+        seeded = None
+    if seeded == fingerprint and os.path.exists(TOKEN_FILE):
+        return
+    if os.path.exists(TOKEN_FILE):
+        print_substep("reddit.creds.refresh_token changed, replacing the saved refresh token.")
+    os.makedirs(os.path.dirname(TOKEN_FILE), exist_ok=True)
+    with open(TOKEN_FILE, "w", encoding="utf-8") as raw_token:
+        raw_token.write(refresh_token)
+    with open(TOKEN_SEED_FILE, "w", encoding="utf-8") as raw_seed:
+        raw_seed.write(fingerprint)
+
+
+def _authenticate() -> praw.Reddit:
+    creds = settings.config["reddit"]["creds"]
+    common = dict(
+        client_id=creds["client_id"],
+        client_secret=creds["client_secret"],
+        user_agent=USER_AGENT,
+        check_for_async=False,
+    )
+
+    refresh_token = creds.get("refresh_token", "")
+    if refresh_token:
+        _seed_token_file(refresh_token)
+    if os.path.exists(TOKEN_FILE):
+        print_substep("Authenticating to Reddit with the saved refresh token.")
+        # reads the refresh token from the file and writes back the new one whenever it rotates
+        return praw.Reddit(token_manager=FileTokenManager(TOKEN_FILE), **common)
+
+    if creds["2fa"]:
+        if not sys.stdin.isatty():
+            raise RuntimeError(
+                "Reddit 2FA is on and there is no terminal to enter the code. "
+                "Set reddit.creds.refresh_token to run unattended."
+            )
+        print("\nEnter your two-factor authentication code from your authenticator app.\n")
+        code = input("> ")
+        passkey = f"{creds['password']}:{code}"
+    else:
+        passkey = creds["password"]
+    username = creds["username"]
+    if str(username).casefold().startswith("u/"):
+        username = username[2:]
+    print_substep("Logging into Reddit.")
+    return praw.Reddit(username=username, password=passkey, **common)
@@ -1,12 +1,16 @@
+import math
 import re
 import random
 from utils import settings
-import praw
-from praw.models import MoreComments
+from praw.models import MoreComments, Submission
 
+from reddit import backlog
+from reddit.client import get_reddit
+from TTS.engine_wrapper import DEFUALT_MAX_LENGTH
 from utils.console import print_step, print_substep
-from utils.subreddit import get_subreddit_undone
-from utils.videos import check_done, isdone
+from utils.speech_rate import chars_per_second, estimate_duration
+from utils.subreddit import get_subreddit_undone, shouldSkip
+from utils.videos import check_done, done_store
 from utils.voice import sanitize_text
 
 
@@ -15,31 +19,117 @@ def camelCase_to_text(text):
     return text
 
 
-def get_subreddit_threads(POST_ID: str, post_type: str = 'top', time_filter: str = 'year', part: str = '0'):
+PLAN_RESOLUTION = 0.1  # seconds
+
+
+def plan_items(items: list, budget: float, text_of, rate: float) -> list:
+    """Picks the items whose narration best fills budget seconds, before any of it is synthesized.
+
+    A 0/1 knapsack over durations estimated from the sanitized text and the speech rate of the
+    voice, learned from past runs (see utils.speech_rate). Of equally full selections, the one
+    with the earliest items wins, so their ranking still counts.
+    Args:
+        items (list): The candidates, in order of preference
+        budget (float): Seconds of narration to fill
+        text_of: Function returning the text that is read out for an item
+        rate (float): Characters spoken per second
+
+    Returns:
+        list: The picked items, in their original order
     """
-    Returns a list of threads from the AskReddit subreddit.
+    capacity = int(budget / PLAN_RESOLUTION)
+    if capacity <= 0 or not items:
+        return []
+    weights = [
+        max(1, math.ceil(estimate_duration(text_of(item), rate) / PLAN_RESOLUTION)) for item in items
+    ]
+    big = len(items) ** 2 + 1  # more than any sum of indices, so filling always comes first
+    best = [0] * (capacity + 1)  # best value of a selection weighing at most c
+    keep = []
+    for k, weight in enumerate(weights):
+        row = bytearray(capacity + 1)
+        value = weight * big - k
+        for c in range(capacity, weight - 1, -1):
+            if best[c - weight] + value > best[c]:
+                best[c] = best[c - weight] + value
+                row[c] = 1
+        keep.append(row)
+
+    picked, c = set(), capacity
+    for k in range(len(items) - 1, -1, -1):
+        if keep[k][c]:
+            picked.add(k)
+            c -= weights[k]
+    return [item for k, item in enumerate(items) if k in picked]
+
+
+INFO_CHUNK = 100  # fullnames /api/info takes per request
+
+
+def fetch_submissions(reddit, ids: list) -> list:
+    """Fetches submissions in bulk through /api/info, instead of one request per lazy submission.
+
+    Args:
+        reddit (praw.Reddit): The client
+        ids (list): Submission ids, without the t3_ prefix
+
+    Returns:
+        list: The submissions in the order of ids, leaving out the ones that don't exist (anymore)
     """
+    fetched = {}
+    for start in range(0, len(ids), INFO_CHUNK):
+        chunk = ids[start: start + INFO_CHUNK]
+        for submission in reddit.info(fullnames=[f"t3_{pid}" for pid in chunk]):
+            fetched[submission.id] = submission
+    missing = [pid for pid in ids if pid not in fetched]
+    if missing:
+        print_substep(f"Skipping posts that couldn't be found: {', '.join(missing)}", style="bold red")
+    return [fetched[pid] for pid in ids if pid in fetched]
 
-    print_substep("[STORYMODE] Logging into Reddit.")
 
-    if settings.config["reddit"]["creds"]["2fa"]:
-        print("\nEnter your two-factor authentication code from your authenticator app.\n")
-        code = input("> ")
-        pw = settings.config["reddit"]["creds"]["password"]
-        passkey = f"{pw}:{code}"
-    else:
-        passkey = settings.config["reddit"]["creds"]["password"]
-    username = settings.config["reddit"]["creds"]["username"]
-    if str(username).casefold().startswith("u/"):
-        username = username[2:]
-    reddit = praw.Reddit(
-        client_id=settings.config["reddit"]["creds"]["client_id"],
-        client_secret=settings.config["reddit"]["creds"]["client_secret"],
-        user_agent="Accessing Reddit threads",
-        username=username,
-        passkey=passkey,
-        check_for_async=False,
+def storymode_contents(sub: str, part: str) -> dict:
+    """Returns the contents of a storymode part of the subreddit, without items yet."""
+    return {'type': 'storymode',
+            'subreddit': camelCase_to_text(sub) + f" part {part}",
+            'thread_subreddit': sub,
+            'part': part,
+            'items': []
+            }
+
+
+def plan_storymode(contents: dict, backlog_name: str = None):
+    """Shuffles the candidate items of a storymode part and keeps the ones its narration fits.
+
+    Args:
+        contents (dict): The part, see storymode_contents
+        backlog_name (str): Backlog the items were taken from, to claim the planned ones in
+    """
+    random.shuffle(contents['items'])
+    rate = chars_per_second()
+    candidates = [item for item in contents['items'] if not shouldSkip(item)]
+    budget = DEFUALT_MAX_LENGTH - estimate_duration(contents['subreddit'], rate)
+    contents['items'] = plan_items(
+        candidates, budget, lambda item: item['thread_title'], rate
+    ) or candidates[:1]
+    print_substep(
+        f"[STORYMODE] Planned {len(contents['items'])} of {len(candidates)} threads, about "
+        f"{sum(estimate_duration(item['thread_title'], rate) for item in contents['items']):.0f}s "
+        f"of {budget:.0f}s.",
+        style="bold blue",
     )
+    if backlog_name is not None and int(contents['part']):
+        # keeps the planned threads from parts made meanwhile, until this one is done or released
+        backlog.claim(backlog_name, int(contents['part']), [item['thread_id'] for item in contents['items']])
+
+
+def get_subreddit_threads(POST_ID: str, post_type: str = 'top', time_filter: str = 'year', part: str = '0',
+                          exclude: set = None):
+    """
+    Returns a list of threads from the AskReddit subreddit.
+    In storymode, threads whose id is in exclude (e.g. claimed by another job) are skipped.
+    """
+
+    reddit = get_reddit()  # authenticated once per process, see reddit/client.py
     sub = ''
     # Ask user for subreddit input
     print_step("Getting subreddit threads...")
@@ -71,18 +161,11 @@ def get_subreddit_threads(POST_ID: str, post_type: str = 'top', time_filter: str
             isurls = 'http' in POST_ID[0]  # checks whether the use has passed urls or actual ids. urls always contain http
         if POST_ID:  # would only be called if there are multiple queued posts
             if isurls:
-                threads = [reddit.submission(url=pid) for pid in POST_ID]
-            else:
-                threads = [reddit.submission(id=pid) for pid in POST_ID]
-        else:
-            if post_type == 'top':
-                threads = subreddit.top(time_filter=time_filter, limit=25)
-            elif post_type == 'hot':
-                threads = subreddit.hot(limit=300)
-            elif post_type == 'random':
-                threads = subreddit.random(limit=300)
+                threads = fetch_submissions(reddit, [Submission.id_from_url(url) for url in POST_ID])
             else:
-                threads = subreddit.controversial(time_filter=time_filter)
+                threads = fetch_submissions(reddit, POST_ID)
+        elif post_type == 'random':
+            threads = subreddit.random(limit=300)
 
         # submission = get_subreddit_undone(threads, subreddit) #TODO: AYA check undone submissions
         # submission = check_done(submission)  # double-checking
@@ -97,22 +180,29 @@ def get_subreddit_threads(POST_ID: str, post_type: str = 'top', time_filter: str
         # print_substep(f"[STORYMODE] Threads have on average {sum(num_comments) / len(num_comments)} comments",
         #               style="bold blue")
 
-        contents = {'type': 'storymode',
-                    'subreddit': camelCase_to_text(sub) + f" part {part}",
-                    'part': part,
-                    'items': []
-                    }
-        for submission in threads:
-            content = {}
-            content["thread_id"] = submission.id
-            if isdone(content["thread_id"]):
-                continue
-            content["thread_subreddit"] = sub
-            content["thread_url"] = f"https://reddit.com{submission.permalink}"
-            content["thread_title"] = submission.title
-            content["thread_post"] = submission.selftext
-            contents['items'].append(content)
-        random.shuffle(contents['items'])
+        contents = storymode_contents(sub, part)
+        backlog_name = sub or subreddit.display_name
+        if threads is None:
+            # the backlog is only refilled from the listings when it runs low, see reddit/backlog.py
+            contents['items'] = [
+                item
+                for item in backlog.take(subreddit, backlog_name, backlog.TAKE, post_type, time_filter)
+                if not (exclude and item["thread_id"] in exclude)
+            ]
+        else:
+            threads = list(threads)
+            done_ids = done_store.done_stories([submission.id for submission in threads])
+            for submission in threads:
+                content = {}
+                content["thread_id"] = submission.id
+                if content["thread_id"] in done_ids or (exclude and content["thread_id"] in exclude):
+                    continue
+                content["thread_subreddit"] = sub
+                content["thread_url"] = f"https://reddit.com{submission.permalink}"
+                content["thread_title"] = submission.title
+                content["thread_post"] = submission.selftext
+                contents['items'].append(content)
+        plan_storymode(contents, backlog_name if threads is None else None)
         print_substep("[STORYMODE] Received subreddit threads Successfully.", style="bold green")
         return contents
     else:# if not story mode
@@ -128,6 +218,8 @@ def get_subreddit_threads(POST_ID: str, post_type: str = 'top', time_filter: str
             # threads = subreddit.hot(limit=25)
             threads = subreddit.top(time_filter='year', limit=25)
             submission = get_subreddit_undone(threads, subreddit)
+            if submission is None:
+                raise RuntimeError(f"r/{subreddit} has no post left to make a video of.")
         submission = check_done(submission)  # double-checking
         if submission is None or not submission.num_comments:
             return get_subreddit_threads(POST_ID)  # submission already done. rerun
@@ -170,5 +262,16 @@ def get_subreddit_threads(POST_ID: str, post_type: str = 'top', time_filter: str
                                 "comment_id": top_level_comment.id,
                             }
                         )
+        rate = chars_per_second()
+        budget = DEFUALT_MAX_LENGTH - sum(
+            estimate_duration(text, rate) for text in [content["thread_subreddit"], content["thread_title"]]
+        )
+        if content["thread_post"] != "" and settings.config["settings"]["storymode"]:
+            budget -= estimate_duration(content["thread_post"], rate)
+        candidates = content["comments"]
+        content["comments"] = plan_items(
+            candidates, budget, lambda comment: comment["comment_body"], rate
+        ) or candidates[:1]
+        print_substep(f"Planned {len(content['comments'])} of {len(candidates)} comments.", style="bold blue")
         print_substep("Received subreddit threads Successfully.", style="bold green")
         return content
@@ -0,0 +1,97 @@
+"""Checks AWSPolly.run_batch against a stub Polly client, no AWS account needed.
+
+Run with: python -m pytest tests
+"""
+
+import io
+import json
+import struct
+
+import pytest
+
+from TTS.aws_polly import AWSPolly
+from utils import settings
+from utils.mp3 import audio_duration
+
+# MPEG-1 layer III, 128 kbps, 44.1 kHz, mono: 417 byte frames of 1152 samples
+HEADER = b"\xff\xfb\x90\xc0"
+FRAME_LENGTH = 417
+FRAME_DURATION = 1152 / 44100
+
+
+def frame(number: int) -> bytes:
+    """Returns a silent frame, its payload tagged with the number to tell frames apart."""
+    return HEADER + struct.pack(">I", number) + bytes(FRAME_LENGTH - 8)
+
+
+def info_frame(frames: int) -> bytes:
+    """Returns an Info frame claiming the stream holds the given number of frames."""
+    tag = b"Info" + struct.pack(">II", 1, frames)
+    return HEADER + bytes(17) + tag + bytes(FRAME_LENGTH - 4 - 17 - len(tag))
+
+
+class StubPolly:
+    """Answers synthesize_speech with a known mp3 and the speech marks of its pieces."""
+
+    def __init__(self, pieces, info=False):
+        self.pieces = pieces  # frames in the audio of every text
+        self.info = info
+        self.requests = []
+
+    def synthesize_speech(self, **params):
+        self.requests.append(params)
+        if params["OutputFormat"] == "mp3":
+            audio = b"".join(frame(i) for i in range(sum(self.pieces)))
+            if self.info:
+                audio = info_frame(sum(self.pieces)) + audio
+            return {"AudioStream": io.BytesIO(audio)}
+        marks, start = [], 0
+        for i, frames in enumerate(self.pieces):
+            time = round(start * FRAME_DURATION * 1000)
+            marks.append(json.dumps({"time": time, "type": "ssml", "value": str(i)}))
+            start += frames
+        return {"AudioStream": io.BytesIO("\n".join(marks).encode("utf-8"))}
+
+
+@pytest.fixture(autouse=True)
+def voice(monkeypatch):
+    monkeypatch.setattr(
+        settings, "config", {"settings": {"tts": {"aws_polly_voice": "matthew"}}}, raising=False
+    )
+
+
+@pytest.mark.parametrize("info", [False, True])
+def test_run_batch_splits_at_the_speech_marks(tmp_path, info):
+    pieces = [40, 25, 60]
+    stub = StubPolly(pieces, info=info)
+    texts = ["First title", "Tom & Jerry <3", "Third title"]
+    filepaths = [str(tmp_path / f"title_{i}.mp3") for i in range(len(texts))]
+
+    durations = AWSPolly(client=stub).run_batch(texts, filepaths)
+
+    # one request for the audio and one for the marks, both of the same SSML document
+    assert [request["OutputFormat"] for request in stub.requests] == ["mp3", "json"]
+    assert stub.requests[0]["Text"] == stub.requests[1]["Text"]
+    ssml = stub.requests[0]["Text"]
+    assert stub.requests[0]["TextType"] == "ssml"
+    assert stub.requests[0]["VoiceId"] == "Matthew"
+    assert ssml.count("<mark ") == len(texts)
+    assert "Tom &amp; Jerry &lt;3" in ssml
+
+    first = 0
+    for filepath, frames, duration in zip(filepaths, pieces, durations):
+        with open(filepath, "rb") as file:
+            data = file.read()
+        # exactly the frames of the piece, the Info frame of the stream dropped
+        assert data == b"".join(frame(i) for i in range(first, first + frames))
+        assert duration == pytest.approx(frames * FRAME_DURATION)
+        assert audio_duration(filepath) == pytest.approx(duration)
+        first += frames
+
+
+def test_run_batch_rejects_missing_speech_marks(tmp_path):
+    stub = StubPolly([10, 10])
+    with pytest.raises(ValueError):
+        AWSPolly(client=stub).run_batch(
+            ["one", "two", "three"], [str(tmp_path / f"{i}.mp3") for i in range(3)]
+        )
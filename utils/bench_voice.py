@@ -0,0 +1,59 @@
+"""Benchmarks utils.voice.chunk_text against the regex split_post used before it.
+
+Run from the repository root: python -m utils.bench_voice
+The texts are generated from a fixed seed, so every run times the same input.
+"""
+
+import random
+import re
+import timeit
+from typing import List
+
+from utils.voice import chunk_text
+
+MAX_CHARS = 300
+WORDS = ["reddit", "thread", "comment", "story", "because", "then", "my", "the", "a", "it"]
+
+
+def regex_split(text: str, max_chars: int) -> List[str]:
+    """The splitting of TTSEngine.split_post before chunk_text replaced it."""
+    return [
+        x.group().strip()
+        for x in re.finditer(r" *(((.|\n){0," + str(max_chars) + r"})(\.|.$))", text)
+    ]
+
+
+def comment(length: int, periods: bool, seed: int = 0) -> str:
+    """Returns a text of about length characters, with a period every 12 words if periods."""
+    rng = random.Random(seed)
+    words = []
+    while sum(len(word) + 1 for word in words) < length:
+        words.append(rng.choice(WORDS))
+        if periods and len(words) % 12 == 0:
+            words[-1] += "."
+    return " ".join(words)
+
+
+def best_of(function, text: str, repeat: int = 5) -> float:
+    """Returns the fastest of repeat runs in milliseconds."""
+    return min(timeit.repeat(lambda: function(text, MAX_CHARS), number=1, repeat=repeat)) * 1000
+
+
+def main():
+    cases = [
+        ("3000 words with periods", comment(3000 * 6, True)),
+        ("10000 chars, no periods", comment(10000, False)),
+        ("20000 chars, no periods", comment(20000, False)),
+    ]
+    print(f"max_chars={MAX_CHARS}, best of 5 runs")
+    print(f"{'input':<26}{'old regex':>12}{'chunk_text':>12}{'kept by regex':>15}")
+    for name, text in cases:
+        kept = sum(len(chunk) for chunk in regex_split(text, MAX_CHARS))
+        print(
+            f"{name:<26}{best_of(regex_split, text):>9.1f} ms{best_of(chunk_text, text):>9.1f} ms"
+            f"{kept / len(text):>14.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -2,26 +2,38 @@ import os
 from os.path import exists
 
 
-def cleanup() -> int:
-    """Deletes all temporary assets in assets/temp
+def cleanup(workspace: str = "assets/temp") -> int:
+    """Deletes all temporary assets in the workspace
+
+    Args:
+        workspace (str): Directory holding the temporary files of a job. Defaults to assets/temp
 
     Returns:
         int: How many files were deleted
     """
-    if exists("./assets/temp"):
+    if exists(workspace):
         count = 0
         files = [f for f in os.listdir(".") if f.endswith(".mp4") and "temp" in f.lower()]
         count += len(files)
         for f in files:
             os.remove(f)
         try:
-            for file in os.listdir("./assets/temp/mp4"):
+            for file in os.listdir(f"{workspace}/mp4"):
+                count += 1
+                os.remove(f"{workspace}/mp4/" + file)
+        except FileNotFoundError:
+            pass
+        try:
+            for file in os.listdir(f"{workspace}/mp3"):
+                count += 1
+                os.remove(f"{workspace}/mp3/" + file)
+        except FileNotFoundError:
+            pass
+        try:
+            for file in os.listdir(f"{workspace}/overlays"):
                 count += 1
-                os.remove("./assets/temp/mp4/" + file)
+                os.remove(f"{workspace}/overlays/" + file)
         except FileNotFoundError:
             pass
-        for file in os.listdir("./assets/temp/mp3"):
-            count += 1
-            os.remove("./assets/temp/mp3/" + file)
         return count
     return 0
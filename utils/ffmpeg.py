@@ -0,0 +1,62 @@
+import os
+import shutil
+import subprocess
+from typing import List
+
+from moviepy.config import get_setting
+
+
+def ffmpeg_binary() -> str:
+    """Returns the ffmpeg executable moviepy is configured to use (imageio-ffmpeg's by default)."""
+    return get_setting("FFMPEG_BINARY")
+
+
+def ffprobe_binary() -> str:
+    """Returns the ffprobe executable, looked up on the PATH and then next to ffmpeg.
+
+    Raises:
+        FileNotFoundError: ffprobe isn't installed. imageio-ffmpeg only ships ffmpeg.
+    """
+    found = shutil.which("ffprobe")
+    if found:
+        return found
+    sibling = os.path.join(os.path.dirname(ffmpeg_binary()), "ffprobe")
+    found = shutil.which(sibling) or shutil.which(sibling + ".exe")
+    if found:
+        return found
+    raise FileNotFoundError("ffprobe was not found, install ffmpeg to get it")
+
+
+def run_ffmpeg(args: List[str]):
+    """Runs ffmpeg with the given arguments, overwriting any existing output.
+
+    Args:
+        args (List[str]): Command line arguments, without the ffmpeg executable itself
+
+    Raises:
+        subprocess.CalledProcessError: ffmpeg exited with a non-zero status. stderr holds its log.
+    """
+    subprocess.run(
+        [ffmpeg_binary(), "-y", "-hide_banner", "-loglevel", "error", *args],
+        check=True,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+
+
+def run_ffprobe(args: List[str]) -> str:
+    """Runs ffprobe with the given arguments and returns what it printed.
+
+    Raises:
+        FileNotFoundError: ffprobe isn't installed
+        subprocess.CalledProcessError: ffprobe exited with a non-zero status
+    """
+    return subprocess.run(
+        [ffprobe_binary(), "-v", "error", *args],
+        check=True,
+        stdin=subprocess.DEVNULL,
+        capture_output=True,
+        text=True,
+    ).stdout
@@ -0,0 +1,319 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Set
+
+HISTORY_DB = "./video_creation/data/history.db"
+STORIES = "./video_creation/data/stories.json"
+VIDEOS = "./video_creation/data/videos.json"
+
+STORY = "story"  # thread used in a storymode part
+ALLOCATION_TTL = 12 * 60 * 60  # seconds after which a part that's still allocated is given back
+VIDEO = "video"  # thread made into a video of its own
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    id INTEGER PRIMARY KEY,
+    subreddit TEXT NOT NULL,
+    part INTEGER,
+    time INTEGER NOT NULL,
+    background_credit TEXT,
+    reddit_title TEXT,
+    filename TEXT
+);
+CREATE TABLE IF NOT EXISTS parts (
+    subreddit TEXT NOT NULL,
+    part INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    allocated_at INTEGER,
+    pid INTEGER,
+    PRIMARY KEY (subreddit, part)
+);
+CREATE TABLE IF NOT EXISTS used_threads (
+    thread_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    video_id INTEGER REFERENCES videos (id),
+    PRIMARY KEY (thread_id, kind)
+);
+CREATE TABLE IF NOT EXISTS candidates (
+    subreddit TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    title TEXT NOT NULL,
+    selftext TEXT NOT NULL,
+    url TEXT NOT NULL,
+    fetched INTEGER NOT NULL,
+    claimed_part INTEGER,
+    PRIMARY KEY (subreddit, thread_id)
+);
+CREATE TABLE IF NOT EXISTS listing_cursors (
+    subreddit TEXT NOT NULL,
+    listing TEXT NOT NULL,
+    after TEXT,
+    exhausted INTEGER NOT NULL DEFAULT 0,
+    updated INTEGER NOT NULL,
+    PRIMARY KEY (subreddit, listing)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_local = threading.local()
+
+
+def connect() -> sqlite3.Connection:
+    """Returns this thread's connection to the history database, creating and importing it first.
+
+    The database is in WAL mode, so readers never block the writer, and every write is one
+    short transaction, so parallel jobs in other processes can safely share it.
+    """
+    connection = getattr(_local, "connection", None)
+    if connection is not None and _local.pid == os.getpid():
+        return connection
+    os.makedirs(os.path.dirname(HISTORY_DB), exist_ok=True)
+    # autocommit mode, transactions are opened explicitly by transaction()
+    connection = sqlite3.connect(HISTORY_DB, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(SCHEMA)
+    columns = {row[1] for row in connection.execute("PRAGMA table_info(parts)")}
+    for column in ("allocated_at", "pid"):  # databases of earlier versions lack them
+        if column not in columns:
+            connection.execute(f"ALTER TABLE parts ADD COLUMN {column} INTEGER")
+    connection.create_function("pid_alive", 1, _pid_alive, deterministic=False)
+    _local.connection, _local.pid = connection, os.getpid()
+    with transaction() as cursor:
+        if cursor.execute("SELECT 1 FROM meta WHERE key = 'imported'").fetchone() is None:
+            _import_json(cursor)
+            cursor.execute(
+                "INSERT INTO meta (key, value) VALUES ('imported', ?)", (str(int(time.time())),)
+            )
+    return connection
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if pid is None:
+        return False
+    if os.name == "nt":  # os.kill(pid, 0) would send CTRL_C_EVENT, allocations expire by age only
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:  # alive, just not ours
+        return True
+    return True
+
+
+def live_allocation(alias: str = "p") -> str:
+    """SQL condition holding for a row of parts (named alias) that's allocated by a running process.
+
+    Allocations of processes that died without releasing them, e.g. on a crash or Ctrl+C, or
+    older than ALLOCATION_TTL don't count, their part numbers and claimed threads are free again.
+    """
+    cutoff = int(time.time()) - ALLOCATION_TTL
+    return (
+        f"{alias}.status = 'allocated' AND {alias}.allocated_at >= {cutoff}"
+        f" AND pid_alive({alias}.pid)"
+    )
+
+
+@contextmanager
+def transaction():
+    """Yields a cursor inside a write transaction, committed if the block succeeds.
+
+    BEGIN IMMEDIATE takes the write lock up front, so read-modify-writes like part allocation
+    are atomic across processes.
+    """
+    cursor = connect().cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        yield cursor
+    except BaseException:
+        cursor.execute("ROLLBACK")
+        raise
+    cursor.execute("COMMIT")
+
+
+def _read_json(path: str):
+    """Reads a history file of earlier versions, which may hold trailing commas or leftovers of
+    a longer previous content, since they were rewritten in place without truncating."""
+    with open(path, "r", encoding="utf-8") as raw_history:
+        text = raw_history.read()
+    try:
+        return json.loads(text)
+    except ValueError:
+        return json.JSONDecoder().raw_decode(re.sub(r",(\s*[}\]])", r"\1", text))[0]
+
+
+def _import_json(cursor: sqlite3.Cursor):
+    """Imports the history kept in stories.json and videos.json by earlier versions, once."""
+    if os.path.exists(STORIES):
+        stories = _read_json(STORIES)
+        for subreddit, done in stories.items():
+            for item in done.get("items", []):
+                video_id = _insert_video(
+                    cursor, subreddit, item.get("part"), int(item.get("time", 0)), item
+                )
+                if item.get("part") is not None:
+                    _mark_part_done(cursor, subreddit, int(item["part"]))
+                _use_threads(cursor, item["ids"].split("+"), STORY, video_id)
+            if done.get("latest_part"):
+                _mark_part_done(cursor, subreddit, int(done["latest_part"]))
+    if os.path.exists(VIDEOS):
+        videos = _read_json(VIDEOS)
+        for video in videos:
+            video_id = _insert_video(
+                cursor, video["subreddit"], None, int(video.get("time", 0)), video
+            )
+            _use_threads(cursor, [video["id"]], VIDEO, video_id)
+
+
+def _insert_video(
+    cursor: sqlite3.Cursor, subreddit: str, part: Optional[int], at: int, video: dict
+) -> int:
+    cursor.execute(
+        "INSERT INTO videos (subreddit, part, time, background_credit, reddit_title, filename)"
+        " VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            subreddit,
+            part,
+            at,
+            video.get("background_credit"),
+            video.get("reddit_title"),
+            video.get("filename"),
+        ),
+    )
+    return cursor.lastrowid
+
+
+def _mark_part_done(cursor: sqlite3.Cursor, subreddit: str, part: int):
+    cursor.execute(
+        "INSERT INTO parts (subreddit, part, status) VALUES (?, ?, 'done')"
+        " ON CONFLICT (subreddit, part) DO UPDATE SET status = 'done'",
+        (subreddit, part),
+    )
+
+
+def _use_threads(cursor: sqlite3.Cursor, thread_ids: Iterable[str], kind: str, video_id: int):
+    cursor.executemany(
+        "INSERT OR IGNORE INTO used_threads (thread_id, kind, video_id) VALUES (?, ?, ?)",
+        [(thread_id, kind, video_id) for thread_id in thread_ids],
+    )
+
+
+def latest_part(subreddit: str) -> int:
+    """Returns the highest part number of the subreddit, allocated or done, 0 if there's none."""
+    row = (
+        connect().execute("SELECT MAX(part) FROM parts WHERE subreddit = ?", (subreddit,)).fetchone()
+    )
+    return row[0] or 0
+
+
+def allocate_part(subreddit: str) -> int:
+    """Reserves the lowest free part number of the subreddit. Safe to call from parallel jobs.
+
+    Release it with release_part if the video isn't made, record_story marks it done. Numbers
+    given back, or left allocated by a process that's gone (see live_allocation), are reused.
+    """
+    with transaction() as cursor:
+        cursor.execute(
+            "DELETE FROM parts AS p WHERE p.subreddit = ? AND p.status = 'allocated'"
+            f" AND NOT ({live_allocation()})",
+            (subreddit,),
+        )
+        (part,) = cursor.execute(
+            "SELECT MIN(p.part + 1) FROM (SELECT 0 AS part UNION ALL"
+            " SELECT part FROM parts WHERE subreddit = ?) AS p"
+            " WHERE NOT EXISTS"
+            " (SELECT 1 FROM parts q WHERE q.subreddit = ? AND q.part = p.part + 1)",
+            (subreddit, subreddit),
+        ).fetchone()
+        # claims left behind by an earlier holder of the number
+        cursor.execute(
+            "UPDATE candidates SET claimed_part = NULL WHERE subreddit = ? AND claimed_part = ?",
+            (subreddit, part),
+        )
+        cursor.execute(
+            "INSERT INTO parts (subreddit, part, status, allocated_at, pid)"
+            " VALUES (?, ?, 'allocated', ?, ?)",
+            (subreddit, part, int(time.time()), os.getpid()),
+        )
+    return part
+
+
+def release_part(subreddit: str, part: int):
+    """Gives back a part number from allocate_part whose video wasn't made."""
+    with transaction() as cursor:
+        cursor.execute(
+            "DELETE FROM parts WHERE subreddit = ? AND part = ? AND status = 'allocated'",
+            (subreddit, part),
+        )
+
+
+def record_story(
+    subreddit: str, part: int, thread_ids: List[str], credit: str, reddit_title: str, filename: str
+):
+    """Records a finished storymode part, the threads it used and marks its part number done."""
+    with transaction() as cursor:
+        video_id = _insert_video(
+            cursor,
+            subreddit,
+            part,
+            int(time.time()),
+            {"background_credit": credit, "reddit_title": reddit_title, "filename": filename},
+        )
+        _mark_part_done(cursor, subreddit, part)
+        _use_threads(cursor, thread_ids, STORY, video_id)
+
+
+def record_video(
+    subreddit: str, thread_id: str, credit: str, reddit_title: str, filename: str
+) -> bool:
+    """Records a finished video of a single thread.
+
+    Returns:
+        bool: False if the thread already had a video, which is then left as is
+    """
+    with transaction() as cursor:
+        if cursor.execute(
+            "SELECT 1 FROM used_threads WHERE thread_id = ? AND kind = ?", (thread_id, VIDEO)
+        ).fetchone():
+            return False
+        video_id = _insert_video(
+            cursor,
+            subreddit,
+            None,
+            int(time.time()),
+            {"background_credit": credit, "reddit_title": reddit_title, "filename": filename},
+        )
+        _use_threads(cursor, [thread_id], VIDEO, video_id)
+    return True
+
+
+def used_threads(thread_ids: Iterable[str], kind: str) -> Set[str]:
+    """Returns which of the given thread ids were already used.
+
+    Args:
+        thread_ids (Iterable[str]): The thread ids to look up
+        kind (str): STORY for threads used in a storymode part, VIDEO for videos of their own
+    """
+    thread_ids = list(thread_ids)
+    used = set()
+    connection = connect()
+    for start in range(0, len(thread_ids), 500):  # stay below SQLite's limit of bound parameters
+        chunk = thread_ids[start : start + 500]
+        used.update(
+            row[0]
+            for row in connection.execute(
+                "SELECT thread_id FROM used_threads WHERE kind = ?"
+                f" AND thread_id IN ({','.join('?' * len(chunk))})",
+                [kind, *chunk],
+            )
+        )
+    return used
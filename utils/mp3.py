@@ -0,0 +1,242 @@
+import json
+import os
+import struct
+import wave
+from subprocess import CalledProcessError
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.ffmpeg import run_ffprobe
+
+MANIFEST = "manifest.json"
+
+# kbps by (MPEG-1, layer), index 0 is "free format" and unsupported
+BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+# Hz by the version bits of the header: 3 is MPEG-1, 2 MPEG-2 and 0 MPEG-2.5
+SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+class FrameHeader:
+    """A parsed MPEG audio frame header."""
+
+    def __init__(
+        self, mpeg1: bool, layer: int, bitrate: int, sample_rate: int, padding: int, mono: bool
+    ):
+        self.mpeg1 = mpeg1
+        self.layer = layer
+        self.bitrate = bitrate
+        self.sample_rate = sample_rate
+        self.mono = mono
+        if layer == 1:
+            self.samples = 384
+            self.length = (12 * bitrate // sample_rate + padding) * 4
+        else:
+            self.samples = 1152 if mpeg1 or layer == 2 else 576
+            self.length = self.samples // 8 * bitrate // sample_rate + padding
+
+    @property
+    def duration(self) -> float:
+        return self.samples / self.sample_rate
+
+
+def parse_header(data: bytes, pos: int) -> Optional[FrameHeader]:
+    """Parses the frame header at data[pos:pos+4], None if there isn't a valid one."""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 3
+    layer = 4 - ((data[pos + 1] >> 1) & 3)
+    bitrate_index = data[pos + 2] >> 4
+    sample_rate_index = (data[pos + 2] >> 2) & 3
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    mpeg1 = version == 3
+    return FrameHeader(
+        mpeg1,
+        layer,
+        BITRATES[(mpeg1, layer)][bitrate_index] * 1000,
+        SAMPLE_RATES[version][sample_rate_index],
+        (data[pos + 2] >> 1) & 1,
+        data[pos + 3] >> 6 == 3,
+    )
+
+
+def _skip_id3(data: bytes, pos: int) -> int:
+    while data[pos : pos + 3] == b"ID3" and pos + 10 <= len(data):
+        size = 0
+        for byte in data[pos + 6 : pos + 10]:  # syncsafe integer, 7 bits per byte
+            size = (size << 7) | (byte & 0x7F)
+        pos += 10 + size + (10 if data[pos + 5] & 0x10 else 0)
+    return pos
+
+
+def _find_frame(data: bytes, pos: int) -> Tuple[int, Optional[FrameHeader]]:
+    """Finds the next frame at or after pos whose successor is a frame too, to skip false syncs."""
+    while True:
+        pos = _skip_id3(data, pos)
+        pos = data.find(b"\xff", pos)
+        if pos < 0:
+            return len(data), None
+        header = parse_header(data, pos)
+        if header is not None:
+            following = pos + header.length
+            if following >= len(data) or parse_header(data, following) is not None:
+                return pos, header
+        pos += 1
+
+
+def _vbr_frames(data: bytes, pos: int, header: FrameHeader) -> Optional[int]:
+    """Returns the frame count of the Xing/Info or VBRI tag in the frame at pos, if there is one."""
+    if header.mpeg1:
+        side_info = 17 if header.mono else 32
+    else:
+        side_info = 9 if header.mono else 17
+    xing = pos + 4 + side_info
+    if data[xing : xing + 4] in (b"Xing", b"Info"):
+        (flags,) = struct.unpack(">I", data[xing + 4 : xing + 8])
+        if flags & 1:
+            (frames,) = struct.unpack(">I", data[xing + 8 : xing + 12])
+            return frames
+    vbri = pos + 36
+    if data[vbri : vbri + 4] == b"VBRI":
+        (frames,) = struct.unpack(">I", data[vbri + 14 : vbri + 18])
+        return frames
+    return None
+
+
+def iter_frames(data: bytes) -> Iterator[Tuple[int, FrameHeader]]:
+    """Yields the offset and header of every MPEG audio frame in data, skipping tags and junk."""
+    pos, header = _find_frame(data, 0)
+    while header is not None:
+        yield pos, header
+        pos += header.length
+        header = parse_header(data, pos)
+        if header is None and pos < len(data) - 128:  # not just an ID3v1 tag left, resync
+            pos, header = _find_frame(data, pos)
+
+
+def mp3_duration(path: str) -> float:
+    """Reads the duration of an mp3 from its frame headers, without decoding it.
+
+    Uses the frame count of a Xing/Info or VBRI tag when the file has one and otherwise walks
+    every frame header, which also holds for several streams concatenated into one file.
+
+    Raises:
+        ValueError: The file holds no MPEG audio frames
+    """
+    with open(path, "rb") as raw_mp3:
+        data = raw_mp3.read()
+    pos, header = _find_frame(data, 0)
+    if header is None:
+        raise ValueError(f"{path} holds no mp3 frames")
+    frames = _vbr_frames(data, pos, header)
+    if frames:
+        return frames * header.duration
+    return sum(header.duration for _, header in iter_frames(data))
+
+
+def split_mp3(data: bytes, starts: List[float]) -> List[Tuple[bytes, float]]:
+    """Splits an mp3 stream at frame boundaries, without re-encoding it.
+
+    Every piece starts at the frame closest to its start time. The first piece also gets whatever
+    comes before starts[0] and the last one runs to the end of the stream. The Xing/Info/VBRI
+    frame of the stream is dropped, see join_mp3.
+    Args:
+        data (bytes): The mp3 stream
+        starts (List[float]): Start time of every piece in seconds, ascending
+
+    Returns:
+        List[Tuple[bytes, float]]: The frames of every piece and its duration
+
+    Raises:
+        ValueError: data holds no MPEG audio frames
+    """
+    frames = list(iter_frames(data))
+    if frames and _vbr_frames(data, *frames[0]) is not None:
+        # its frame count is of the whole stream and would be read as the length of the first piece
+        frames = frames[1:]
+    if not frames:
+        raise ValueError("The stream holds no mp3 frames")
+    pieces = []
+    boundaries = iter(starts[1:])
+    boundary = next(boundaries, None)
+    piece_pos, piece_time, time = frames[0][0], 0.0, 0.0
+    for pos, header in frames:
+        while boundary is not None and time + header.duration / 2 > boundary:
+            pieces.append((data[piece_pos:pos], time - piece_time))
+            piece_pos, piece_time = pos, time
+            boundary = next(boundaries, None)
+        time += header.duration
+    end = frames[-1][0] + frames[-1][1].length
+    pieces.append((data[piece_pos:end], time - piece_time))
+    while len(pieces) < len(starts):  # starts past the end of the stream
+        pieces.append((b"", 0.0))
+    return pieces
+
+
+def join_mp3(streams: List[bytes]) -> bytes:
+    """Joins mp3 streams into one at the frame level, without decoding them.
+
+    Tags are dropped, including the Xing/Info/VBRI frame of each stream, whose frame count would
+    otherwise claim the length of the first stream for the whole file. The streams should share
+    a sample rate, as the clips of one TTS voice do.
+
+    Raises:
+        ValueError: A stream holds no MPEG audio frames
+    """
+    joined = bytearray()
+    for stream in streams:
+        frames = list(iter_frames(stream))
+        if not frames:
+            raise ValueError("The stream holds no mp3 frames")
+        if _vbr_frames(stream, *frames[0]) is not None:
+            frames = frames[1:]
+        for pos, header in frames:
+            joined += stream[pos : pos + header.length]
+    return bytes(joined)
+
+
+def audio_duration(path: str) -> float:
+    """Returns the duration of an mp3 or wav file in seconds.
+
+    Parses the file in process and only asks ffprobe if that fails.
+
+    Raises:
+        ValueError: The duration couldn't be read, e.g. the file is missing or not audio
+    """
+    try:
+        if os.path.splitext(path)[1].lower() == ".wav":
+            with wave.open(path, "rb") as raw_wav:
+                return raw_wav.getnframes() / raw_wav.getframerate()
+        return mp3_duration(path)
+    except (OSError, EOFError, ValueError, wave.Error, struct.error) as parse_error:
+        try:
+            return float(
+                run_ffprobe(
+                    ["-show_entries", "format=duration", "-of", "default=nw=1:nk=1", path]
+                ).strip()
+            )
+        except (OSError, CalledProcessError, ValueError) as error:
+            raise ValueError(f"Couldn't read the duration of {path}: {parse_error}") from error
+
+
+def read_manifest(directory: str) -> Dict[str, float]:
+    """Returns the durations recorded by the TTS engine in directory, keyed by clip filename."""
+    try:
+        with open(os.path.join(directory, MANIFEST), "r", encoding="utf-8") as raw_manifest:
+            return json.load(raw_manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(directory: str, durations: Dict[str, float]):
+    """Records the durations of the clips in directory, keyed by clip filename."""
+    path = os.path.join(directory, MANIFEST)
+    with open(path + ".tmp", "w", encoding="utf-8") as raw_manifest:
+        json.dump(durations, raw_manifest, indent=4)
+    os.replace(path + ".tmp", path)
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+from multiprocessing.managers import BaseManager
+from time import monotonic, sleep
+from typing import Dict, Optional, Union
+
+
+class RateLimiter:
+    """Bounds how many requests to a service run at once and how many start per second.
+
+    Use it as a context manager around every request. Thread safe.
+    Args:
+        max_concurrent (int): Maximum number of requests in flight
+        requests_per_second (float): Maximum number of requests started per second, 0 for no limit
+    """
+
+    def __init__(self, max_concurrent: int = 1, requests_per_second: float = 0):
+        self.max_concurrent = max_concurrent
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._interval = 1 / requests_per_second if requests_per_second else 0
+        self._lock = threading.Lock()
+        self._next_start = 0.0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def acquire(self):
+        """Waits for a free slot and the start time of the next request."""
+        self._slots.acquire()
+        if self._interval:
+            with self._lock:
+                now = monotonic()
+                wait = self._next_start - now
+                self._next_start = max(now, self._next_start) + self._interval
+            if wait > 0:
+                sleep(wait)
+
+    def release(self):
+        self._slots.release()
+
+
+class SharedRateLimiter:
+    """A RateLimiter living in the process of a RateLimitManager, shared by every process using it.
+
+    Used like a RateLimiter. Every thread talks to the manager over its own connection.
+    """
+
+    def __init__(self, proxy, max_concurrent: int):
+        self.max_concurrent = max_concurrent
+        self._proxy = proxy
+
+    def __enter__(self):
+        self._proxy.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._proxy.release()
+
+
+class AsyncRateLimiter:
+    """RateLimiter for coroutines, used as an async context manager around every request.
+
+    It also holds requests back until the server's rate limit window resets once the headers
+    passed to observe show it's nearly used up. Not thread safe, use it from one event loop.
+    Args:
+        max_concurrent (int): Maximum number of requests in flight
+        requests_per_second (float): Maximum number of requests started per second, 0 for no limit
+        min_remaining (int): Requests left in the server's window below which the limiter waits for its reset
+    """
+
+    def __init__(
+        self, max_concurrent: int = 1, requests_per_second: float = 0, min_remaining: int = 0
+    ):
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._interval = 1 / requests_per_second if requests_per_second else 0
+        self._min_remaining = min_remaining
+        self._next_start = 0.0
+        self._reset = 0.0  # unix time the server's window resets at, if it's nearly used up
+
+    def observe(self, remaining: Optional[float], reset_timestamp: Optional[float]):
+        """Takes in the rate limit headers of the latest response."""
+        if remaining is not None and reset_timestamp and remaining < self._min_remaining:
+            self._reset = max(self._reset, reset_timestamp)
+
+    async def __aenter__(self):
+        await self._slots.acquire()
+        now = monotonic()
+        start = max(now, self._next_start, now + self._reset - time.time())
+        self._next_start = start + self._interval
+        if start > now:
+            await asyncio.sleep(start - now)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._slots.release()
+
+
+_limiters: Dict[str, Union[RateLimiter, SharedRateLimiter]] = {}
+_limiters_lock = threading.Lock()
+_manager_address = None  # of the RateLimitManager the limiters of this process are shared through
+
+
+def _served_limiter(name: str, max_concurrent: int, requests_per_second: float) -> RateLimiter:
+    # runs in the manager's process, whose _limiters hold the shared limiters
+    with _limiters_lock:
+        if name not in _limiters:
+            _limiters[name] = RateLimiter(max_concurrent, requests_per_second)
+        return _limiters[name]
+
+
+class RateLimitManager(BaseManager):
+    """Serves the rate limiters shared by the job processes of a parallel run, see share_rate_limiters."""
+
+
+RateLimitManager.register("get_rate_limiter", _served_limiter, exposed=("acquire", "release"))
+
+
+def serve_rate_limiters() -> RateLimitManager:
+    """Starts a process holding the rate limiters of a parallel run. Shut it down when the run ends.
+
+    Pass its address to share_rate_limiters in every job process, so the limits of a service
+    hold for all of them together rather than for each one.
+    """
+    manager = RateLimitManager()
+    manager.start()
+    return manager
+
+
+def share_rate_limiters(address):
+    """Makes get_rate_limiter of this process return the limiters served at address."""
+    global _manager_address
+    with _limiters_lock:
+        _manager_address = address
+        _limiters.clear()
+
+
+def get_rate_limiter(
+    name: str, max_concurrent: int = 1, requests_per_second: float = 0
+) -> Union[RateLimiter, SharedRateLimiter]:
+    """Returns the process-wide rate limiter of a service, creating it on first use.
+
+    After share_rate_limiters it's the limiter shared by every process of the run instead.
+    Args:
+        name (str): Name of the service, e.g. the TTS provider
+        max_concurrent (int): Maximum number of requests in flight, used on creation
+        requests_per_second (float): Maximum number of requests started per second, used on creation
+
+    Returns:
+        Union[RateLimiter, SharedRateLimiter]: The limiter shared by every caller using the same name
+    """
+    with _limiters_lock:
+        if name not in _limiters:
+            if _manager_address is None:
+                _limiters[name] = RateLimiter(max_concurrent, requests_per_second)
+            else:
+                manager = RateLimitManager(address=_manager_address)
+                manager.connect()
+                _limiters[name] = SharedRateLimiter(
+                    manager.get_rate_limiter(name, max_concurrent, requests_per_second),
+                    max_concurrent,
+                )
+        return _limiters[name]
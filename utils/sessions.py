@@ -0,0 +1,114 @@
+import logging
+import random
+import threading
+import time
+from typing import Dict
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.console import print_substep
+from utils.voice import sleep_until
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name: str, pool_size: int = 1) -> requests.Session:
+    """Returns the process-wide keep-alive session of a service, creating it on first use.
+
+    Connections are reused across requests, so only the first request to a host pays for the TLS
+    handshake. Retries are left to request_with_backoff.
+    Args:
+        name (str): Name of the service, e.g. the TTS provider class
+        pool_size (int): Connections kept open per host, usually the concurrency of the service
+    """
+    with _sessions_lock:
+        if name not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[name] = session
+        return _sessions[name]
+
+
+def _reset_delay(reset: str, max_wait: float) -> float:
+    """Seconds until X-RateLimit-Reset, which is either a unix timestamp or a number of seconds."""
+    value = float(reset)
+    if value > 1e9:
+        value -= time.time()
+    return min(max(value, 0), max_wait)
+
+
+def request_with_backoff(
+    session: requests.Session,
+    method: str,
+    url: str,
+    retries: int = 5,
+    backoff: float = 0.5,
+    max_wait: float = 60,
+    **kwargs,
+) -> requests.Response:
+    """Sends a request, retrying connection errors, rate limits and server errors.
+
+    Waits are exponential with full jitter, except for a 429 carrying X-RateLimit-Reset, which
+    waits until the reset. Retries happen in a loop, so a long run of 429s can't exhaust the stack.
+    Args:
+        session (requests.Session): Session to send the request with, see get_session
+        method (str): HTTP method
+        url (str): URL of the request
+        retries (int): How many times to retry before giving up
+        backoff (float): Base of the exponential wait in seconds
+        max_wait (float): Longest single wait in seconds
+        **kwargs: Passed on to session.request
+
+    Returns:
+        requests.Response: The last response, which may still be an error if retries ran out
+
+    Raises:
+        requests.exceptions.RequestException: The last attempt failed to connect
+    """
+    kwargs.setdefault("timeout", 30)
+    host = urlsplit(url).netloc
+    for attempt in range(retries + 1):
+        delay = random.uniform(0, min(max_wait, backoff * 2**attempt))
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as error:
+            logger.debug(
+                "%s %s failed after %.0f ms: %s",
+                method,
+                host,
+                (time.perf_counter() - start) * 1000,
+                error,
+            )
+            if attempt == retries:
+                raise
+            time.sleep(delay)
+            continue
+        logger.debug(
+            "%s %s -> %d in %.0f ms",
+            method,
+            host,
+            response.status_code,
+            (time.perf_counter() - start) * 1000,
+        )
+        if response.status_code not in RETRY_STATUSES or attempt == retries:
+            return response
+        reset = response.headers.get("X-RateLimit-Reset")
+        if response.status_code == 429 and reset:
+            try:
+                delay = _reset_delay(reset, max_wait)
+            except ValueError:
+                pass
+            print_substep(f"Ratelimit hit on {host}. Sleeping for {delay:.0f} seconds.")
+            sleep_until(time.time() + delay)
+        else:
+            time.sleep(delay)
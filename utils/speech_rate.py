@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+from utils import settings
+from utils.voice import sanitize_text
+
+SPEECH_RATES = "assets/speech_rates.json"
+DEFAULT_CHARS_PER_SECOND = 15.0
+MIN_SECONDS = 30  # of audio observed before a voice's own rate is trusted
+
+
+def current_voice() -> str:
+    """Returns the key of the configured TTS provider and voice, e.g. "tiktok:en_us_006".
+
+    The voice is the setting named after the provider (streamlabspolly -> streamlabs_polly_voice),
+    the language for providers without one.
+    """
+    tts = settings.config["settings"]["tts"]
+    choice = str(tts["choice"]).casefold()
+    for key, value in tts.items():
+        if key.endswith("_voice") and key[: -len("_voice")].replace("_", "") == choice:
+            return f"{choice}:{value}"
+    return f"{choice}:{settings.config['reddit']['thread']['post_lang'] or 'en'}"
+
+
+def _load() -> Dict[str, Dict[str, float]]:
+    try:
+        with open(SPEECH_RATES, "r", encoding="utf-8") as raw_rates:
+            return json.load(raw_rates)
+    except (OSError, ValueError):
+        return {}
+
+
+def chars_per_second(voice: Optional[str] = None) -> float:
+    """Returns how many characters of sanitized text the voice speaks per second.
+
+    Learned from past runs, see SpeechRateRecorder. DEFAULT_CHARS_PER_SECOND until the voice
+    has spoken for MIN_SECONDS.
+    """
+    stats = _load().get(voice or current_voice())
+    if not stats or stats["seconds"] < MIN_SECONDS:
+        return DEFAULT_CHARS_PER_SECOND
+    return stats["chars"] / stats["seconds"]
+
+
+def estimate_duration(text: str, rate: float) -> float:
+    """Estimates how long text takes to say at rate characters per second."""
+    return len(sanitize_text(text)) / rate
+
+
+class SpeechRateRecorder:
+    """Accumulates how much text a voice spoke in how much time, to be added to SPEECH_RATES.
+
+    Thread safe.
+    """
+
+    def __init__(self, voice: str):
+        self.voice = voice
+        self.chars = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, text: str, duration: float):
+        with self._lock:
+            self.chars += len(text)
+            self.seconds += duration
+
+    def save(self):
+        """Adds the observations to SPEECH_RATES. Concurrent saves may drop each other's, which only delays learning."""
+        if not self.seconds:
+            return
+        rates = _load()
+        stats = rates.setdefault(self.voice, {"chars": 0, "seconds": 0.0})
+        stats["chars"] += self.chars
+        stats["seconds"] += self.seconds
+        self.chars, self.seconds = 0, 0.0
+        os.makedirs(os.path.dirname(SPEECH_RATES), exist_ok=True)
+        temp = f"{SPEECH_RATES}.{os.getpid()}.tmp"
+        with open(temp, "w", encoding="utf-8") as raw_rates:
+            json.dump(rates, raw_rates, indent=4)
+        os.replace(temp, SPEECH_RATES)
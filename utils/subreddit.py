@@ -1,8 +1,11 @@
-import json
-from os.path import exists
+import time
+from typing import Optional
 
+from reddit.client import get_reddit
 from utils import settings
 from utils.console import print_substep
+from utils.videos import done_store
+from utils.voice import sleep_until
 
 
 def shouldSkip(thread):
@@ -11,45 +14,98 @@ def shouldSkip(thread):
     _bool += [word in thread['thread_post'].lower() for word in blacklist]
     return any(_bool)
 
-def get_subreddit_undone(submissions: list, subreddit):
-    """_summary_
+# searched in order once the listing given to get_subreddit_undone has no undone submission
+FALLBACK_LISTINGS = [
+    ("top", "hour"),
+    ("top", "day"),
+    ("top", "week"),
+    ("top", "month"),
+    ("top", "year"),
+    ("top", "all"),
+    ("hot", None),
+]
+PAGE = 100  # the most reddit returns per listing request
+MAX_REQUESTS = 10  # listing requests one search may make
+MIN_REMAINING = 5  # requests left in the rate limit window below which the search waits for its reset
 
+
+def _wait_for_rate_limit(reddit):
+    """Sleeps until the rate limit window resets if it's nearly used up, going by the headers praw saw last."""
+    limits = reddit.auth.limits
+    remaining, reset = limits.get("remaining"), limits.get("reset_timestamp")
+    if remaining is not None and reset and remaining < MIN_REMAINING:
+        print_substep(f"Reddit rate limit nearly reached, waiting {max(0, reset - time.time()):.0f}s...")
+        sleep_until(reset)
+
+
+def _fetch_page(subreddit, listing: str, time_filter: Optional[str], after: Optional[str]) -> list:
+    params = {"after": after} if after else {}
+    if listing == "top":
+        return list(subreddit.top(time_filter=time_filter, limit=PAGE, params=params))
+    return list(subreddit.hot(limit=PAGE, params=params))
+
+
+def _qualifies(submission) -> bool:
+    if submission.over_18:
+        try:
+            if not settings.config["settings"]["allow_nsfw"]:
+                print_substep("NSFW Post Detected. Skipping...")
+                return False
+        except AttributeError:
+            print_substep("NSFW settings not defined. Skipping NSFW post...")
+    if submission.stickied:
+        print_substep("This post was pinned by moderators. Skipping...")
+        return False
+    if submission.num_comments <= int(settings.config["reddit"]["thread"]["min_comments"]):
+        print_substep(
+            f'This post has under the specified minimum of comments ({settings.config["reddit"]["thread"]["min_comments"]}). Skipping...'
+        )
+        return False
+    return True
+
+
+def get_subreddit_undone(submissions: list, subreddit, max_requests: int = MAX_REQUESTS):
+    """Finds the first submission that hasn't been made into a video yet.
+
+    Goes through submissions first, then pages through FALLBACK_LISTINGS in order, each until it's
+    exhausted, for at most max_requests listing requests. Waits for the rate limit window to reset
+    before a request if it's nearly used up.
     Args:
         submissions (list): List of posts that are going to potentially be generated into a video
         subreddit (praw.Reddit.SubredditHelper): Chosen subreddit
+        max_requests (int): Listing requests the search may make after submissions
 
     Returns:
-        Any: The submission that has not been done
+        Any: The submission that has not been done, None if there's none within the budget
     """
-    # recursively checks if the top submission in the list was already done.
-    if not exists("./video_creation/data/videos.json"):
-        with open("./video_creation/data/videos.json", "w+") as f:
-            json.dump([], f)
-    with open("./video_creation/data/videos.json", "r", encoding="utf-8") as done_vids_raw:
-        done_videos = json.load(done_vids_raw)
-    for submission in submissions:
-        if already_done(done_videos, submission):
-            continue
-        if submission.over_18:
-            try:
-                if not settings.config["settings"]["allow_nsfw"]:
-                    print_substep("NSFW Post Detected. Skipping...")
-                    continue
-            except AttributeError:
-                print_substep("NSFW settings not defined. Skipping NSFW post...")
-        if submission.stickied:
-            print_substep("This post was pinned by moderators. Skipping...")
-            continue
-        if submission.num_comments <= int(settings.config["reddit"]["thread"]["min_comments"]):
-            print_substep(
-                f'This post has under the specified minimum of comments ({settings.config["reddit"]["thread"]["min_comments"]}). Skipping...'
-            )
-            continue
-        return submission
-    print("all submissions have been done going by top submission order")
-    return get_subreddit_undone(
-        subreddit.top(time_filter="hour"), subreddit
-    )  # all the videos in hot have already been done
+    reddit = get_reddit()
+    seen = set()
+    listings = iter(FALLBACK_LISTINGS)
+    listing, time_filter, after = None, None, None
+    requests = 0
+    page = list(submissions)
+    while True:
+        fresh = [submission for submission in page if str(submission) not in seen]
+        seen.update(str(submission) for submission in fresh)
+        done_ids = done_store.done_videos([str(submission) for submission in fresh])
+        for submission in fresh:
+            if str(submission) not in done_ids and _qualifies(submission):
+                return submission
+
+        if listing is None or len(page) < PAGE:  # move on to the next listing
+            listing, time_filter = next(listings, (None, None))
+            after = None
+            if listing is None:
+                print_substep("Every listing of the subreddit has been searched.", style="bold red")
+                return None
+        else:
+            after = page[-1].fullname
+        if requests >= max_requests:
+            print_substep(f"No undone post found within {max_requests} requests.", style="bold red")
+            return None
+        _wait_for_rate_limit(reddit)
+        page = _fetch_page(subreddit, listing, time_filter, after)
+        requests += 1
 
 
 def already_done(done_videos: list, submission) -> bool:
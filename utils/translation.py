@@ -0,0 +1,137 @@
+import json
+import os
+import threading
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from utils import settings
+from utils.console import print_substep
+
+TRANSLATIONS = "assets/translations.json"
+BATCH_CHARS = 4500  # google translate rejects much longer texts
+
+
+def _google(text: str, lang: str) -> str:
+    import translators as ts
+
+    return ts.google(text, to_language=lang)
+
+
+class Translator:
+    """Translates texts through a persistent memo keyed by (text, target language).
+
+    Concurrent requests for the same text wait for the one already in flight, so a text is sent
+    at most once per process, and texts translated by an earlier run aren't sent at all. Thread safe.
+    Args:
+        path (str): JSON file holding the memo
+        backend: Function translating a text to a language
+    """
+
+    def __init__(self, path: str = TRANSLATIONS, backend=_google):
+        self.path = path
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._memo: Optional[Dict[str, Dict[str, str]]] = None
+        self._in_flight: Dict[Tuple[str, str], Future] = {}
+
+    def _load(self) -> Dict[str, Dict[str, str]]:
+        if self._memo is None:
+            try:
+                with open(self.path, "r", encoding="utf-8") as raw_memo:
+                    self._memo = json.load(raw_memo)
+            except (OSError, ValueError):
+                self._memo = {}
+        return self._memo
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            snapshot = json.dumps(self._memo, ensure_ascii=False)
+        with open(temp, "w", encoding="utf-8") as raw_memo:
+            raw_memo.write(snapshot)
+        os.replace(temp, self.path)
+
+    def translate_many(self, texts: List[str], lang: str) -> List[str]:
+        """Translates texts to lang, sending the ones not translated yet in as few requests as possible.
+
+        Returns:
+            List[str]: The translations, in the order of texts
+        """
+        claimed, waiting = [], {}
+        with self._lock:
+            known = self._load().setdefault(lang, {})
+            for text in dict.fromkeys(texts):
+                if text in known:
+                    continue
+                if (text, lang) in self._in_flight:
+                    waiting[text] = self._in_flight[(text, lang)]
+                else:
+                    self._in_flight[(text, lang)] = Future()
+                    claimed.append(text)
+
+        if claimed:
+            print_substep(f"Translating {len(claimed)} texts...")
+            try:
+                translated = dict(zip(claimed, self._send(claimed, lang)))
+            except BaseException as error:
+                with self._lock:
+                    for text in claimed:
+                        self._in_flight.pop((text, lang)).set_exception(error)
+                raise
+            with self._lock:
+                known.update(translated)
+                for text in claimed:
+                    self._in_flight.pop((text, lang)).set_result(translated[text])
+            self._save()
+        for future in waiting.values():
+            future.result()
+        return [known[text] for text in texts]
+
+    def _send(self, texts: List[str], lang: str) -> List[str]:
+        """Joins single-line texts by newlines into requests of up to BATCH_CHARS characters.
+
+        A batch whose translation doesn't come back with one line per text is sent text by text.
+        """
+        batches, single, translated = [[]], [], {}
+        for text in texts:
+            if not text.strip():
+                translated[text] = text
+                continue
+            if "\n" in text or len(text) > BATCH_CHARS:
+                single.append(text)
+                continue
+            if sum(len(t) + 1 for t in batches[-1]) + len(text) > BATCH_CHARS:
+                batches.append([])
+            batches[-1].append(text)
+
+        for batch in batches:
+            if len(batch) > 1:
+                lines = self.backend("\n".join(batch), lang).split("\n")
+                if len(lines) == len(batch):
+                    translated.update(zip(batch, (line.strip() for line in lines)))
+                    continue
+            single += batch
+        for text in single:
+            translated[text] = self.backend(text, lang)
+        return [translated[text] for text in texts]
+
+
+translator = Translator()
+
+
+def _target(lang: Optional[str]) -> str:
+    return lang if lang is not None else settings.config["reddit"]["thread"]["post_lang"]
+
+
+def translate(text: str, lang: Optional[str] = None) -> str:
+    """Translates text to lang, post_lang by default. Returns text as is if there's no target."""
+    lang = _target(lang)
+    return translator.translate_many([text], lang)[0] if lang else text
+
+
+def prefetch(texts: List[str], lang: Optional[str] = None):
+    """Translates texts ahead of their use, batching them into as few requests as possible."""
+    lang = _target(lang)
+    if lang and texts:
+        translator.translate_many(texts, lang)
@@ -1,33 +1,49 @@
-import json
-import time
-from typing import Dict
+from typing import Iterable, List, Optional, Set
 
 from praw.models import Submission
 
-from utils import settings
+from utils import history, settings
 from utils.console import print_step
 
 
+class DoneStore:
+    """Answers which threads were already used in a video, see utils.history.
+
+    Lookups take a batch of ids and are a single indexed query, so they cost the same however
+    long the history grows.
+    """
+
+    def done_stories(self, ids: Iterable[str]) -> Set[str]:
+        """Returns which of the given thread ids were already used in a storymode video."""
+        return history.used_threads(ids, history.STORY)
+
+    def done_videos(self, ids: Iterable[str]) -> Set[str]:
+        """Returns which of the given thread ids already have a video."""
+        return history.used_threads(ids, history.VIDEO)
+
+
+done_store = DoneStore()
+
+
 def get_part_num(subreddit) -> int:
-    with open("./video_creation/data/stories.json", "r", encoding="utf-8") as raw_vids:
-        all_done_vids = json.load(raw_vids)
-        subreddit_done_vids = all_done_vids[subreddit] if subreddit in all_done_vids.keys() else {}
-        latest_part = subreddit_done_vids['latest_part'] if 'latest_part' in subreddit_done_vids.keys() else 0
-        return latest_part
+    return history.latest_part(subreddit)
+
+
+def allocate_part(subreddit: str) -> int:
+    """Reserves the next part number of the subreddit, see utils.history.allocate_part."""
+    return history.allocate_part(subreddit)
+
+
+def release_part(subreddit: str, part: int):
+    """Gives back a part number whose video wasn't made."""
+    history.release_part(subreddit, part)
 
 
 def isdone(post_id) -> bool:
     """
     checks if a post has been present in any previous video.
     """
-    with open("./video_creation/data/stories.json", "r", encoding="utf-8") as done_stories_raw:
-        done_stories = json.load(done_stories_raw)
-
-    done_ids_groups = [[v['ids'].split('+') for v in a['items']]  for a in done_stories.values()]
-    flat_list = [x for xs in done_ids_groups for x in xs]
-    # flat_list = [x for xs in flat_list for x in xs]
-
-    return any([post_id in done_ids_group for done_ids_group in flat_list])
+    return bool(done_store.done_stories([post_id]))
 
 
 def check_done(
@@ -42,10 +58,7 @@ def check_done(
     Returns:
         Submission|None: Reddit object in args
     """
-    with open("./video_creation/data/videos.json", "r", encoding="utf-8") as done_vids_raw:
-        done_videos = json.load(done_vids_raw)
-    done_ids = [a['id'] for a in done_videos]
-    if str(redditobj) in done_ids:
+    if done_store.done_videos([str(redditobj)]):
         if settings.config["reddit"]["thread"]["post_id"]:
             print_step(
                 "You already have done this video but since it was declared specifically in the config file the program will continue"
@@ -68,8 +81,15 @@ def check_done(
     return redditobj
 
 
-def save_data_v2(subreddit: str, filename: str, reddit_title: str, threads_ids: str, credit: str):
-    """Saves the videos that have already been generated to a JSON file in video_creation/data/videos.json
+def save_data_v2(
+    subreddit: str,
+    filename: str,
+    reddit_title: str,
+    threads_ids: List[str],
+    credit: str,
+    part: Optional[int] = None,
+):
+    """Saves the storymode videos that have already been generated to the history database
 
     Args:
         filename (str): The finished video title name
@@ -77,27 +97,15 @@ def save_data_v2(subreddit: str, filename: str, reddit_title: str, threads_ids:
         @param filename:
         @param threads_ids:
         @param reddit_title:
+        @param part: The part number allocated to this video. Allocated now if not given
     """
-    with open("./video_creation/data/stories.json", "r+", encoding="utf-8") as raw_vids:
-        all_done_vids = json.load(raw_vids)
-        all_done_vids[subreddit] = all_done_vids[subreddit] if subreddit in all_done_vids.keys() else {}
-        all_done_vids[subreddit]['latest_part'] = all_done_vids[subreddit]['latest_part'] + 1 if 'latest_part' in all_done_vids[subreddit].keys() else 1
-        all_done_vids[subreddit]['items'] = [] if 'items' not in all_done_vids[subreddit].keys() else all_done_vids[subreddit]['items']
-        all_done_vids[subreddit]['items'].append({
-            "subreddit": subreddit,
-            "ids": "+".join(threads_ids),
-            "time": str(int(time.time())),
-            "background_credit": credit,
-            "reddit_title": reddit_title,
-            "filename": filename,
-            "part": all_done_vids[subreddit]['latest_part']
-        })
-        raw_vids.seek(0)
-        json.dump(all_done_vids, raw_vids, ensure_ascii=False, indent=4)
+    if part is None:
+        part = allocate_part(subreddit)
+    history.record_story(subreddit, part, threads_ids, credit, reddit_title, filename)
 
 
 def save_data(subreddit: str, filename: str, reddit_title: str, reddit_id: str, credit: str):
-    """Saves the videos that have already been generated to a JSON file in video_creation/data/videos.json
+    """Saves the videos that have already been generated to the history database
 
     Args:
         filename (str): The finished video title name
@@ -106,18 +114,5 @@ def save_data(subreddit: str, filename: str, reddit_title: str, reddit_id: str,
         @param reddit_id:
         @param reddit_title:
     """
-    with open("./video_creation/data/videos.json", "r+", encoding="utf-8") as raw_vids:
-        done_vids = json.load(raw_vids)
-        if reddit_id in [video["id"] for video in done_vids]:
-            return  # video already done but was specified to continue anyway in the config file
-        payload = {
-            "subreddit": subreddit,
-            "id": reddit_id,
-            "time": str(int(time.time())),
-            "background_credit": credit,
-            "reddit_title": reddit_title,
-            "filename": filename,
-        }
-        done_vids.append(payload)
-        raw_vids.seek(0)
-        json.dump(done_vids, raw_vids, ensure_ascii=False, indent=4)
+    # False if the video was already done but was specified to continue anyway in the config file
+    history.record_video(subreddit, reddit_id, credit, reddit_title, filename)
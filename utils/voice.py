@@ -105,3 +105,40 @@ def sanitize_text(text: str, blacklist: list = None) -> str:
 
     # remove extra whitespace
     return " ".join(result.split())
+
+
+SENTENCE = re.compile(r"[^.!?\n]*(?:[.!?]+|\n+|$)")
+
+
+def chunk_text(text: str, max_chars: int) -> list:
+    """Splits text into chunks of at most max_chars characters for TTS providers with a limit.
+
+    Chunks end at sentence boundaries where possible, else at word boundaries. Only a word longer
+    than max_chars is cut. Runs in linear time, whatever the text looks like.
+    Args:
+        text (str): Text to split
+        max_chars (int): Maximum length of a chunk
+
+    Returns:
+        list: The chunks, stripped and never empty
+    """
+    pieces = []
+    for sentence in SENTENCE.findall(text):
+        sentence = sentence.strip()
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for word in sentence.split():
+            pieces.extend(word[i : i + max_chars] for i in range(0, len(word), max_chars))
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if not piece:
+            continue
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,67 @@
+import os
+from itertools import accumulate
+from subprocess import CalledProcessError
+from typing import List, Optional
+
+from moviepy.audio.AudioClip import concatenate_audioclips
+from moviepy.audio.io.AudioFileClip import AudioFileClip
+
+from utils.console import print_substep
+from utils.ffmpeg import run_ffmpeg
+from utils.mp3 import audio_duration, read_manifest
+
+
+def clip_durations(clips: List[str]) -> List[float]:
+    """Returns the durations of the clips, from the manifest written by the TTS engine.
+
+    Clips missing from the manifest are probed.
+    """
+    manifests, durations = {}, []
+    for clip in clips:
+        directory, name = os.path.split(clip)
+        if directory not in manifests:
+            manifests[directory] = read_manifest(directory)
+        duration = manifests[directory].get(name)
+        durations.append(duration if duration is not None else audio_duration(clip))
+    return durations
+
+
+def assemble_audio(
+    clips: List[str], output: str, durations: Optional[List[float]] = None
+) -> List[float]:
+    """Builds the narration track of a video: concatenates the clips and encodes them to AAC once.
+
+    Uses the ffmpeg concat demuxer, so the clips are decoded a single time and never resampled by
+    moviepy. The renderer then muxes the track in as is.
+    Args:
+        clips (List[str]): Paths of the narration clips, in order
+        output (str): Path of the AAC track (.m4a)
+        durations (Optional[List[float]]): Durations of the clips, see clip_durations if not given
+
+    Returns:
+        List[float]: The timestamps at which every clip starts, followed by the end of the track
+    """
+    if durations is None:
+        durations = clip_durations(clips)
+    concat_list = f"{output}.txt"
+    with open(concat_list, "w", encoding="utf-8") as raw_list:
+        for clip in clips:
+            path = os.path.abspath(clip).replace("'", "'\\''")
+            raw_list.write(f"file '{path}'\n")
+    try:
+        run_ffmpeg(
+            ["-f", "concat", "-safe", "0", "-i", concat_list]
+            + ["-vn", "-c:a", "aac", "-b:a", "192k", output]
+        )
+    except (OSError, CalledProcessError) as error:
+        stderr = getattr(error, "stderr", None) or error
+        print_substep(f"ffmpeg concat failed, concatenating with moviepy: {stderr}")
+        audio_clips = [AudioFileClip(clip) for clip in clips]
+        concatenate_audioclips(audio_clips).write_audiofile(
+            output, codec="aac", bitrate="192k", verbose=False, logger=None
+        )
+        for audio in audio_clips:
+            audio.close()
+    finally:
+        os.remove(concat_list)
+    return [0.0] + list(accumulate(durations))
@@ -1,16 +1,24 @@
+import bisect
+import json
+import os
 from pathlib import Path
 import random
 from random import randrange
-from typing import Any, Tuple
+from subprocess import CalledProcessError
+from typing import Any, Dict, List, Optional, Tuple
 
 
 from moviepy.editor import VideoFileClip
-from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_subclip
 from pytube import YouTube
 from pytube.cli import on_progress
 
 from utils import settings
 from utils.console import print_step, print_substep
+from utils.ffmpeg import run_ffmpeg, run_ffprobe
+from video_creation.final_video import W, H
+
+PROXY_FPS = 30
+BACKGROUND_INDEX = "assets/backgrounds/index.json"
 
 # Supported Background. Can add/remove background video here....
 # <key>-<value> : key -> used as keyword for TOML file. value -> background configuration
@@ -54,22 +62,28 @@ background_options = {
 }
 
 
-def get_start_and_end_times(video_length: int, length_of_clip: int) -> Tuple[int, int]:
+def get_start_and_end_times(
+    video_length: int, length_of_clip: int, keyframes: Optional[List[float]] = None
+) -> Tuple[float, float]:
     """Generates a random interval of time to be used as the background of the video.
 
     Args:
         video_length (int): Length of the video
         length_of_clip (int): Length of the video to be used as the background
+        keyframes (Optional[List[float]]): Sorted keyframe timestamps. If given, the start is snapped
+            back to the closest keyframe so the interval can be cut without re-encoding.
 
     Returns:
-        tuple[int,int]: Start and end time of the randomized interval
+        tuple[float,float]: Start and end time of the randomized interval
     """
     random_time = randrange(180, int(length_of_clip) - int(video_length))
+    if keyframes:
+        random_time = keyframes[max(bisect.bisect_right(keyframes, random_time) - 1, 0)]
     return random_time, random_time + video_length
 
 
-def get_background_config():
-    """Fetch the background/s configuration"""
+def get_background_choice() -> str:
+    """Returns the key of the background to use in background_options"""
     try:
         choice = str(settings.config["settings"]["background"]["background_choice"]).casefold()
     except AttributeError:
@@ -81,7 +95,12 @@ def get_background_config():
     if not choice or choice not in background_options:
         choice = random.choice(list(background_options.keys()))
 
-    return background_options[choice]
+    return choice
+
+
+def get_background_config():
+    """Fetch the background/s configuration"""
+    return background_options[get_background_choice()]
 
 
 def download_background(background_config: Tuple[str, str, str, Any]):
@@ -102,32 +121,168 @@ def download_background(background_config: Tuple[str, str, str, Any]):
     print_substep("Background videos downloaded successfully! 🎉", style="bold green")
 
 
-def chop_background_video(background_config: Tuple[str, str, str, Any], video_length: int):
-    """Generates the background footage to be used in the video and writes it to assets/temp/background.mp4
+def get_background_proxy(background_config: Tuple[str, str, str, Any]) -> str:
+    """Returns the portrait proxy of a downloaded background, building it the first time it is needed.
 
+    The proxy is already cropped to W x H, resampled to PROXY_FPS and encoded with one second GOPs,
+    so the chop and render stages never have to decode and scale the full size video again.
     Args:
         background_config (Tuple[str, str, str, Any]) : Current background configuration
-        video_length (int): Length of the clip where the background footage is to be taken out of
+
+    Returns:
+        str: Path of the proxy video
     """
+    choice = f"{background_config[2]}-{background_config[1]}"
+    source = f"assets/backgrounds/{choice}"
+    proxy = f"assets/backgrounds/proxy/{choice}"
+    if Path(proxy).is_file() and os.path.getmtime(proxy) >= os.path.getmtime(source):
+        return proxy
 
-    print_step("Finding a spot in the backgrounds video to chop...✂️")
+    print_substep(f"Building a {W}x{H} proxy of {choice}, this is only done once...")
+    Path("assets/backgrounds/proxy").mkdir(parents=True, exist_ok=True)
+    temp_proxy = f"{proxy}.part.mp4"
+    try:
+        run_ffmpeg(
+            ["-i", source, "-an"]
+            + ["-vf", f"scale=-2:{H},crop={W}:{H},fps={PROXY_FPS},setsar=1"]
+            + ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-pix_fmt", "yuv420p"]
+            + ["-g", str(PROXY_FPS), "-keyint_min", str(PROXY_FPS), "-sc_threshold", "0"]
+            + [temp_proxy]
+        )
+        os.replace(temp_proxy, proxy)
+    finally:
+        if Path(temp_proxy).is_file():
+            os.remove(temp_proxy)
+    print_substep("Background proxy built successfully!", style="bold green")
+    return proxy
+
+
+def get_background_source(background_config: Tuple[str, str, str, Any]) -> str:
+    """Returns the video the background footage should be cut from: the proxy if enabled, else the download."""
     choice = f"{background_config[2]}-{background_config[1]}"
+    try:
+        use_proxy = settings.config["settings"]["background"]["background_proxy"]
+    except KeyError:
+        use_proxy = True
+    if use_proxy:
+        try:
+            return get_background_proxy(background_config)
+        except (OSError, CalledProcessError) as error:
+            stderr = getattr(error, "stderr", None) or error
+            print_substep(f"Couldn't build the background proxy, using the original: {stderr}")
+    return f"assets/backgrounds/{choice}"
 
-    background = VideoFileClip(f"assets/backgrounds/{choice}")
 
-    start_time, end_time = get_start_and_end_times(video_length, background.duration)
+def _probe_background(path: str) -> Dict[str, Any]:
+    """Reads the duration, frame rate and keyframe timestamps of a video.
+
+    Falls back to moviepy (and no keyframes) if ffprobe isn't available.
+    """
     try:
-        raise OSError
-        ffmpeg_extract_subclip(
-            f"assets/backgrounds/{choice}",
-            start_time,
-            end_time,
-            targetname="assets/temp/background.mp4",
+        info = json.loads(
+            run_ffprobe(
+                ["-select_streams", "v:0", "-show_entries", "stream=r_frame_rate:format=duration"]
+                + ["-of", "json", path]
+            )
+        )
+        numerator, denominator = info["streams"][0]["r_frame_rate"].split("/")
+        packets = run_ffprobe(
+            ["-select_streams", "v:0", "-show_entries", "packet=pts_time,flags"]
+            + ["-of", "csv=p=0", path]
         )
-    except (OSError, IOError):  # ffmpeg issue see #348
+        keyframes = sorted(
+            float(pts_time)
+            for pts_time, _, flags in (line.partition(",") for line in packets.splitlines())
+            if "K" in flags and pts_time not in ("", "N/A")
+        )
+        return {
+            "duration": float(info["format"]["duration"]),
+            "fps": float(numerator) / float(denominator),
+            "keyframes": keyframes,
+        }
+    except (OSError, CalledProcessError, KeyError, IndexError, ValueError):
+        with VideoFileClip(path) as video:
+            return {"duration": video.duration, "fps": video.fps, "keyframes": []}
+
+
+def get_background_index(path: str) -> Dict[str, Any]:
+    """Returns the duration, fps and keyframe timestamps of a background video.
+
+    Results are kept in assets/backgrounds/index.json and only recomputed when the video changes.
+    Args:
+        path (str): Path of the background video
+
+    Returns:
+        Dict[str, Any]: {"duration": float, "fps": float, "keyframes": List[float], ...}
+    """
+    index = {}
+    if Path(BACKGROUND_INDEX).is_file():
+        with open(BACKGROUND_INDEX, "r", encoding="utf-8") as raw_index:
+            index = json.load(raw_index)
+    stat = os.stat(path)
+    entry = index.get(path)
+    if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+        return entry
+
+    print_substep(f"Indexing keyframes of {path}...")
+    entry = {"size": stat.st_size, "mtime": stat.st_mtime, **_probe_background(path)}
+    index[path] = entry
+    temp_index = f"{BACKGROUND_INDEX}.{os.getpid()}.tmp"
+    with open(temp_index, "w", encoding="utf-8") as raw_index:
+        json.dump(index, raw_index)
+    os.replace(temp_index, BACKGROUND_INDEX)
+    return entry
+
+
+def get_chop_mode() -> str:
+    """Returns the configured chop mode, "keyframe" (stream copy) or "precise" (re-encode)."""
+    try:
+        return str(settings.config["settings"]["background"]["chop_mode"]).casefold() or "keyframe"
+    except KeyError:
+        return "keyframe"
+
+
+def chop_background_video(
+    background_config: Tuple[str, str, str, Any], video_length: int, workspace: str = "assets/temp"
+):
+    """Generates the background footage to be used in the video and writes it to {workspace}/background.mp4
+
+    In keyframe mode the start is snapped to a keyframe and the footage is cut by stream copy.
+    Precise mode, or a background without a keyframe index, re-encodes the exact interval.
+    Args:
+        background_config (Tuple[str, str, str, Any]) : Current background configuration
+        video_length (int): Length of the clip where the background footage is to be taken out of
+        workspace (str): Directory holding the temporary files of the current job
+    """
+
+    print_step("Finding a spot in the backgrounds video to chop...✂️")
+    Path(workspace).mkdir(parents=True, exist_ok=True)
+    source = get_background_source(background_config)
+    background = get_background_index(source)
+    keyframes = background["keyframes"] if get_chop_mode() == "keyframe" else None
+
+    start_time, end_time = get_start_and_end_times(video_length, background["duration"], keyframes)
+    try:
+        if keyframes:
+            run_ffmpeg(
+                ["-ss", f"{start_time:.3f}", "-i", source, "-t", f"{end_time - start_time:.3f}"]
+                + ["-map", "0:v:0", "-c", "copy", "-avoid_negative_ts", "make_zero"]
+                + [f"{workspace}/background.mp4"]
+            )
+        else:
+            run_ffmpeg(
+                ["-ss", f"{start_time:.3f}", "-i", source, "-t", f"{end_time - start_time:.3f}"]
+                + ["-an", "-c:v", "libx264", "-preset", "veryfast", "-crf", "18"]
+                + [f"{workspace}/background.mp4"]
+            )
+    except (OSError, CalledProcessError):  # ffmpeg issue see #348
         print_substep("FFMPEG issue. Trying again...")
-        with VideoFileClip(f"assets/backgrounds/{choice}") as video:
+        with VideoFileClip(source) as video:
             new = video.subclip(start_time, end_time)
-            new.write_videofile("assets/temp/background.mp4")
+            # moviepy puts its temporary audio in the working directory, shared by every job
+            new.write_videofile(
+                f"{workspace}/background.mp4",
+                temp_audiofile=f"{workspace}/background_temp_audio.mp3",
+            )
     print_substep("Background video chopped successfully!", style="bold green")
     return background_config[2]
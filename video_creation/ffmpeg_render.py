@@ -0,0 +1,107 @@
+import multiprocessing
+from typing import Any, List, Tuple
+
+from utils.ffmpeg import run_ffmpeg
+
+FPS = 30
+X264_PRESET = "veryfast"
+
+# moviepy expands a single string position to both axes like this (see VideoClip.set_position)
+STRING_POSITIONS = {
+    "center": ("center", "center"),
+    "left": ("left", "center"),
+    "right": ("right", "center"),
+    "top": ("center", "top"),
+    "bottom": ("center", "bottom"),
+}
+
+
+def _axis_expression(start, end, frame: str, overlay: str) -> str:
+    if isinstance(start, str):
+        return {
+            "left": "0",
+            "top": "0",
+            "center": f"({frame}-{overlay})/2",
+            "right": f"{frame}-{overlay}",
+            "bottom": f"{frame}-{overlay}",
+        }[start]
+    slope = end - start
+    return f"{start}+{slope}*t" if slope else str(start)
+
+
+def position_to_expressions(position: Any) -> Tuple[str, str]:
+    """Translates a moviepy clip position (background_config[3]) into ffmpeg overlay x/y expressions.
+
+    Callable positions are sampled at t=0 and t=1 and treated as linear in t,
+    which holds for every entry in background_options.
+
+    Args:
+        position (Any): A position string, an (x, y) tuple or a function of t returning one
+
+    Returns:
+        tuple[str,str]: The x and y expressions for the overlay filter
+    """
+    start, end = (position(0), position(1)) if callable(position) else (position, position)
+    if isinstance(start, str):
+        start, end = STRING_POSITIONS[start], STRING_POSITIONS[end]
+    return (
+        _axis_expression(start[0], end[0], "W", "w"),
+        _axis_expression(start[1], end[1], "H", "h"),
+    )
+
+
+def render_video(
+    background: str,
+    overlays: List[Tuple[str, float]],
+    audio: str,
+    position: Any,
+    output: str,
+    size: Tuple[int, int] = (1080, 1920),
+) -> float:
+    """Renders the final video with a single ffmpeg filter graph.
+
+    The background is scaled and cropped to size and every screenshot is overlaid only while its
+    narration plays. The narration track is muxed in without re-encoding.
+    Screenshots are expected at their final size and opacity, see video_creation.overlays.
+
+    Args:
+        background (str): Path of the chopped background video
+        overlays (List[Tuple[str, float]]): (png path, duration) of each screenshot, in order
+        audio (str): Path of the AAC narration track, see video_creation.audio
+        position (Any): Position of the screenshots, see background_options
+        output (str): Path of the rendered video
+        size (Tuple[int, int]): Width and height of the rendered video
+
+    Returns:
+        float: Duration of the rendered video
+    """
+    width, height = size
+    x, y = position_to_expressions(position)
+    total = sum(duration for _, duration in overlays)
+
+    inputs = ["-i", background]
+    filters = [f"[0:v]scale=-2:{height},crop={width}:{height},fps={FPS},setsar=1[v0]"]
+    start = 0.0
+    for idx, (image, duration) in enumerate(overlays, start=1):
+        end = start + duration
+        # a single decoded frame shifted to its start and repeated by the overlay, so a screenshot
+        # costs the same however long the video is
+        inputs += ["-i", image]
+        filters.append(f"[{idx}:v]setpts=PTS-STARTPTS+{start:.3f}/TB[s{idx}]")
+        filters.append(
+            f"[v{idx - 1}][s{idx}]overlay=x={x}:y={y}"
+            f":enable='between(t,{start:.3f},{end:.3f})':eof_action=repeat[v{idx}]"
+        )
+        start = end
+
+    inputs += ["-i", audio]
+
+    run_ffmpeg(
+        inputs
+        + ["-filter_complex", ";".join(filters)]
+        + ["-map", f"[v{len(overlays)}]", "-map", f"{len(overlays) + 1}:a"]
+        + ["-c:v", "libx264", "-preset", X264_PRESET, "-pix_fmt", "yuv420p", "-r", str(FPS)]
+        + ["-c:a", "copy"]
+        + ["-t", f"{total:.3f}", "-threads", str(multiprocessing.cpu_count()), output]
+    )
+    return total
@@ -2,15 +2,14 @@
 import multiprocessing
 import os
 import re
+from contextlib import contextmanager
 from os.path import exists
-from typing import Tuple, Any
-from moviepy.audio.AudioClip import concatenate_audioclips, CompositeAudioClip
-from moviepy.audio.io.AudioFileClip import AudioFileClip
+from subprocess import CalledProcessError
+from typing import Tuple, Any, List
 from moviepy.video.VideoClip import ImageClip, TextClip
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
 from moviepy.video.compositing.concatenate import concatenate_videoclips
 from moviepy.video.io.VideoFileClip import VideoFileClip
-from moviepy.video.io.ffmpeg_tools import ffmpeg_extract_subclip
 from rich.console import Console
 
 from utils.cleanup import cleanup
@@ -18,36 +17,120 @@ from utils.console import print_step, print_substep
 from utils.videos import save_data, save_data_v2
 from utils import settings
 from utils.subreddit import shouldSkip
+from utils.translation import translate
+from video_creation import ffmpeg_render
+from video_creation.audio import assemble_audio
+from video_creation.overlays import prepare_overlay
 
 console = Console()
 W, H = 1080, 1920
 
 
 def name_normalize(name: str) -> str:
+    # translated first, so the translation is the one the TTS and screenshots already fetched
+    # and whatever it contains is made safe for a filename too
+    name = translate(name)
     name = re.sub(r'[?\\"%*:|<>]', "", name)
     name = re.sub(r"( [w,W]\s?\/\s?[o,O,0])", r" without", name)
     name = re.sub(r"( [w,W]\s?\/)", r" with", name)
     name = re.sub(r"(\d+)\s?\/\s?(\d+)", r"\1 of \2", name)
     name = re.sub(r"(\w+)\s?\/\s?(\w+)", r"\1 or \2", name)
     name = re.sub(r"\/", r"", name)
+    return name
 
-    lang = settings.config["reddit"]["thread"]["post_lang"]
-    if lang:
-        import translators as ts
 
-        print_substep("Translating filename...")
-        translated_name = ts.google(name, to_language=lang)
-        return translated_name
+@contextmanager
+def atomic_output(path: str):
+    """Yields a temporary path next to path and moves it into place once the block succeeds.
 
-    else:
-        return name
+    Half-written videos therefore never show up in the results folder.
+    Args:
+        path (str): The final path of the file
+    """
+    directory, name = os.path.split(path)
+    # keep the .mp4 extension, moviepy and ffmpeg infer the container from it
+    temp_path = os.path.join(directory, f".{name}.part.mp4")
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        if exists(temp_path):
+            os.remove(temp_path)
+
+
+def get_render_engine() -> str:
+    """Returns the configured render engine, either "moviepy" or "ffmpeg"."""
+    try:
+        return str(settings.config["settings"]["render"]["engine"]).casefold() or "moviepy"
+    except KeyError:
+        return "moviepy"
+
+
+def render_final_video(
+        background: str,
+        overlays: List[Tuple[str, float, int]],
+        audio: str,
+        position: Any,
+        opacity: float,
+        output: str,
+        workspace: str = "assets/temp",
+) -> float:
+    """Composites the screenshots over the background with the narration and writes it to output.
+
+    Uses the configured render engine. moviepy is used as a fallback if ffmpeg fails.
+    Args:
+        background (str): Path of the chopped background video
+        overlays (List[Tuple[str, float, int]]): (png path, duration, width) of each screenshot, in order
+        audio (str): Path of the narration track, see assemble_audio. It is muxed in without re-encoding
+        position (Any): Position of the screenshots, background_config[3]
+        opacity (float): Opacity of the screenshots
+        output (str): Path of the rendered video
+        workspace (str): Directory holding the temporary files of the current job
+
+    Returns:
+        float: Duration of the rendered video
+    """
+    # resize and fold the opacity into every screenshot once, outside of the per frame loop
+    prepared = [
+        (prepare_overlay(image, width, opacity, workspace), duration)
+        for image, duration, width in overlays
+    ]
+
+    if get_render_engine() == "ffmpeg":
+        try:
+            return ffmpeg_render.render_video(
+                background,
+                prepared,
+                audio,
+                position,
+                output,
+                size=(W, H),
+            )
+        except (OSError, CalledProcessError) as error:
+            stderr = getattr(error, "stderr", None) or error
+            print_substep(f"ffmpeg render failed, falling back to moviepy: {stderr}", style="bold red")
+
+    background_clip = VideoFileClip(background).without_audio()
+    if tuple(background_clip.size) != (W, H):  # backgrounds cut from a proxy are already W x H
+        background_clip = background_clip.resize(height=H).crop(x1=1166.6, y1=0, x2=2246.6, y2=1920)
+    image_clips = [ImageClip(image).set_duration(duration) for image, duration in prepared]
+    image_concat = concatenate_videoclips(image_clips).set_position(position)
+    final = CompositeVideoClip([background_clip, image_concat])
+    final.write_videofile(
+        output,
+        audio=audio,  # muxed with -acodec copy
+        fps=30,
+        verbose=False,
+        threads=multiprocessing.cpu_count(),
+    )
+    return final.duration
 
 
-def generate_intro_image(subreddit_name, part, left_margin=150):
+def generate_intro_image(subreddit_name, part, left_margin=150, workspace="assets/temp"):
     duration = 1
     bg_path = 'assets/backgrounds/subreddit-dark-backgound.png'
-    fg_path = 'assets/temp/png/subreddit-icon.png'
-    txt_path = 'assets/temp/png/introtext.png'
+    fg_path = f'{workspace}/png/subreddit-icon.png'
+    txt_path = f'{workspace}/png/introtext.png'
     bg = ImageClip(bg_path, duration=duration)
     fg = (ImageClip(fg_path)
           .set_duration(duration)
@@ -60,7 +143,7 @@ def generate_intro_image(subreddit_name, part, left_margin=150):
         (left_margin + fg.w + 30, H / 2 - 20)).set_duration(duration).save_frame(txt_path)
     txt = ImageClip(txt_path, duration=1).set_position((left_margin + fg.w + 30, "center"))
     final = CompositeVideoClip([bg, fg, txt])
-    final.save_frame('assets/temp/png/intro.png')
+    final.save_frame(f'{workspace}/png/intro.png')
 
 
 def make_final_video(
@@ -68,13 +151,15 @@ def make_final_video(
         length: int,
         reddit_obj: dict,
         background_config: Tuple[str, str, str, Any],
+        workspace: str = "assets/temp",
 ):
-    """Gathers audio clips, gathers all screenshots, stitches them together and saves the final video to assets/temp
+    """Gathers audio clips, gathers all screenshots, stitches them together and saves the final video to results/{subreddit}
     Args:
         number_of_clips (int): Index to end at when going through the screenshots'
         length (int): Length of the video
         reddit_obj (dict): The reddit object that contains the posts to read.
         background_config (Tuple[str, str, str, Any]): The background config to use.
+        workspace (str): Directory holding the temporary files of the current job
     """
     # try:  # if it isn't found (i.e you just updated and copied over config.toml) it will throw an error
     #    VOLUME_MULTIPLIER = settings.config["settings"]['background']["background_audio_volume"]
@@ -84,51 +169,24 @@ def make_final_video(
     print_step("Creating the final video 🎥")
     subreddit = settings.config["reddit"]["thread"]["subreddit"]
 
-    VideoFileClip.reW = lambda clip: clip.resize(width=W)
-    VideoFileClip.reH = lambda clip: clip.resize(width=H)
     opacity = settings.config["settings"]["opacity"]
-    background_clip = (
-        VideoFileClip("assets/temp/background.mp4")
-            .without_audio()
-            .resize(height=H)
-            .crop(x1=1166.6, y1=0, x2=2246.6, y2=1920)
-    )
 
-    # Gather all audio clips
-    audio_clips = []
-    audio_clips.append(AudioFileClip("assets/temp/mp3/subreddit.mp3"))
-    audio_clips.append(AudioFileClip("assets/temp/mp3/title.mp3"))
-    audio_clips += [AudioFileClip(f"assets/temp/mp3/{i}.mp3") for i in range(number_of_clips)]
-    audio_concat = concatenate_audioclips(audio_clips)
-    audio_composite = CompositeAudioClip([audio_concat])
+    # Gather all audio clips into the narration track
+    audio_clips = [f"{workspace}/mp3/subreddit.mp3", f"{workspace}/mp3/title.mp3"]
+    audio_clips += [f"{workspace}/mp3/{i}.mp3" for i in range(number_of_clips)]
+    boundaries = assemble_audio(audio_clips, f"{workspace}/narration.m4a")
+    durations = [end - start for start, end in zip(boundaries, boundaries[1:])]
 
     console.log(f"[bold green] Video Will Be: {length} Seconds Long")
     # add title to video
-    image_clips = []
-    # Gather all images
+    # Gather all images as (path, duration, width)
     new_opacity = 1 if opacity is None or float(opacity) >= 1 else float(opacity)
-    image_clips.insert(
-        0,
-        ImageClip("assets/temp/png/subreddit.png")
-            .set_duration(audio_clips[0].duration)
-            .resize(width=W + 100)
-            .set_opacity(new_opacity),
-    )
-    image_clips.insert(
-        1,
-        ImageClip("assets/temp/png/title.png")
-            .set_duration(audio_clips[1].duration)
-            .resize(width=W - 100)
-            .set_opacity(new_opacity),
-    )
-
+    overlays = [
+        (f"{workspace}/png/subreddit.png", durations[0], W + 100),
+        (f"{workspace}/png/title.png", durations[1], W - 100),
+    ]
     for i in range(0, number_of_clips):
-        image_clips.append(
-            ImageClip(f"assets/temp/png/comment_{i}.png")
-                .set_duration(audio_clips[i + 1].duration)
-                .resize(width=W - 100)
-                .set_opacity(new_opacity)
-        )
+        overlays.append((f"{workspace}/png/comment_{i}.png", durations[i + 1], W - 100))
 
     # if os.path.exists("assets/mp3/posttext.mp3"):
     #    image_clips.insert(
@@ -141,10 +199,6 @@ def make_final_video(
     #    )
     # else: story mode stuff
     img_clip_pos = background_config[3]
-    image_concat = concatenate_videoclips(image_clips).set_position(img_clip_pos)
-    image_concat.audio = audio_composite
-    final = CompositeVideoClip([background_clip, image_concat])
-    # final = CompositeVideoClip([image_concat])
     title = re.sub(r"[^\w\s-]", "", reddit_obj["thread_title"])
     idx = re.sub(r"[^\w\s-]", "", reddit_obj["thread_id"])
 
@@ -152,7 +206,7 @@ def make_final_video(
 
     if not exists(f"./results/{subreddit}"):
         print_substep("The results folder didn't exist so I made it")
-        os.makedirs(f"./results/{subreddit}")
+        os.makedirs(f"./results/{subreddit}", exist_ok=True)  # parallel jobs may race to create it
 
     # if settings.config["settings"]['background']["background_audio"] and exists(f"assets/backgrounds/background.mp3"):
     #    audioclip = mpe.AudioFileClip(f"assets/backgrounds/background.mp3").set_duration(final.duration)
@@ -162,20 +216,16 @@ def make_final_video(
     #    #    VOLUME_MULTIPLIER)  # lower volume by background_audio_volume, use with fx
     #    final.set_audio(final_audio)
 
-    final.write_videofile(
-        "assets/temp/temp.mp4",
-        fps=30,
-        audio_codec="aac",
-        audio_bitrate="192k",
-        verbose=False,
-        threads=multiprocessing.cpu_count(),
-    )
-    ffmpeg_extract_subclip(
-        "assets/temp/temp.mp4",
-        0,
-        final.duration,
-        targetname=f"results/{subreddit}/{filename}",
-    )
+    with atomic_output(f"results/{subreddit}/{filename}") as output:
+        render_final_video(
+            f"{workspace}/background.mp4",
+            overlays,
+            f"{workspace}/narration.m4a",
+            img_clip_pos,
+            new_opacity,
+            output,
+            workspace=workspace,
+        )
     save_data(subreddit, filename, title, idx, background_config[2])
     # print_step("Removing temporary files 🗑")
     # cleanups = cleanup()
@@ -192,13 +242,15 @@ def make_final_video_v2(
         length: int,
         reddit_obj: dict,
         background_config: Tuple[str, str, str, Any],
+        workspace: str = "assets/temp",
 ):
-    """Gathers audio clips, gathers all screenshots, stitches them together and saves the final video to assets/temp
+    """Gathers audio clips, gathers all screenshots, stitches them together and saves the final video to results/{subreddit}
     Args:
         number_of_clips (int): Index to end at when going through the screenshots'
         length (int): Length of the video
         reddit_obj (dict): The reddit object that contains the posts to read.
         background_config (Tuple[str, str, str, Any]): The background config to use.
+        workspace (str): Directory holding the temporary files of the current job
     """
     # try:  # if it isn't found (i.e you just updated and copied over config.toml) it will throw an error
     #    VOLUME_MULTIPLIER = settings.config["settings"]['background']["background_audio_volume"]
@@ -211,56 +263,37 @@ def make_final_video_v2(
             length,
             reddit_obj,
             background_config,
+            workspace,
         )
         return
 
     print_step("Creating the final video 🎥")
 
-    subreddit = settings.config["reddit"]["thread"]["subreddit"]
-    generate_intro_image(subreddit, reddit_obj['part'])
+    # parts fetched for several subreddits at once carry their own, see reddit/async_fetch.py
+    subreddit = reddit_obj.get('thread_subreddit') or settings.config["reddit"]["thread"]["subreddit"]
+    generate_intro_image(subreddit, reddit_obj['part'], workspace=workspace)
 
-    VideoFileClip.reW = lambda clip: clip.resize(width=W)
-    VideoFileClip.reH = lambda clip: clip.resize(width=H)
     opacity = settings.config["settings"]["opacity"]
-    background_clip = (
-        VideoFileClip("assets/temp/background.mp4")
-            .without_audio()
-            .resize(height=H)
-            .crop(x1=1166.6, y1=0, x2=2246.6, y2=1920)
-    )
 
-    # Gather all audio clips
-    audio_clips = []
-    audio_clips.append(AudioFileClip("assets/temp/mp3/subreddit.mp3"))
-    audio_clips += [AudioFileClip(f"assets/temp/mp3/title_{i}.mp3") for i in range(number_of_clips) if
+    # Gather all audio clips into the narration track
+    audio_clips = [f"{workspace}/mp3/subreddit.mp3"]
+    audio_clips += [f"{workspace}/mp3/title_{i}.mp3" for i in range(number_of_clips) if
                     not shouldSkip(reddit_obj['items'][i])]
-    audio_concat = concatenate_audioclips(audio_clips)
-    audio_composite = CompositeAudioClip([audio_concat])
+    boundaries = assemble_audio(audio_clips, f"{workspace}/narration.m4a")
+    durations = [end - start for start, end in zip(boundaries, boundaries[1:])]
 
     console.log(f"[bold green] Video Will Be: {length} Seconds Long")
     # add title to video
-    image_clips = []
-    # Gather all images
+    # Gather all images as (path, duration, width)
     new_opacity = 1 if opacity is None or float(opacity) >= 1 else float(opacity)
-    image_clips.insert(
-        0,
-        ImageClip("assets/temp/png/intro.png")
-            .set_duration(audio_clips[0].duration)
-            .resize(width=W + 100)
-            .set_opacity(new_opacity),
-    )
+    overlays = [(f"{workspace}/png/intro.png", durations[0], W + 100)]
 
     j=-1
     for i in range(0, number_of_clips):
         if shouldSkip(reddit_obj['items'][i]):
             continue
         j += 1
-        image_clips.append(
-            ImageClip(f"assets/temp/png/title_{i}.png")
-                .set_duration(audio_clips[j + 1].duration)
-                .resize(width=W - 100)
-                .set_opacity(new_opacity)
-        )
+        overlays.append((f"{workspace}/png/title_{i}.png", durations[j + 1], W - 100))
 
     # if os.path.exists("assets/mp3/posttext.mp3"):
     #    image_clips.insert(
@@ -273,19 +306,14 @@ def make_final_video_v2(
     #    )
     # else: story mode stuff
     img_clip_pos = background_config[3]
-    image_concat = concatenate_videoclips(image_clips).set_position(img_clip_pos)
-    image_concat.audio = audio_composite
-    final = CompositeVideoClip([background_clip, image_concat])
-    # final = CompositeVideoClip([image_concat])
     # title = re.sub(r"[^\w\s-]", "", reddit_obj["thread_title"])
     # idx = re.sub(r"[^\w\s-]", "", reddit_obj["thread_id"])
 
     filename = f"{name_normalize(reddit_obj['subreddit'])}.mp4"
-    subreddit = settings.config["reddit"]["thread"]["subreddit"]
 
     if not exists(f"./results/{subreddit}"):
         print_substep("The results folder didn't exist so I made it")
-        os.makedirs(f"./results/{subreddit}")
+        os.makedirs(f"./results/{subreddit}", exist_ok=True)  # parallel jobs may race to create it
 
     # if settings.config["settings"]['background']["background_audio"] and exists(f"assets/backgrounds/background.mp3"):
     #    audioclip = mpe.AudioFileClip(f"assets/backgrounds/background.mp3").set_duration(final.duration)
@@ -295,24 +323,20 @@ def make_final_video_v2(
     #    #    VOLUME_MULTIPLIER)  # lower volume by background_audio_volume, use with fx
     #    final.set_audio(final_audio)
 
-    final.write_videofile(
-        "assets/temp/temp.mp4",
-        fps=30,
-        audio_codec="aac",
-        audio_bitrate="192k",
-        verbose=False,
-        threads=multiprocessing.cpu_count(),
-    )
-    ffmpeg_extract_subclip(
-        "assets/temp/temp.mp4",
-        0,
-        final.duration,
-        targetname=f"results/{subreddit}/{filename}",
-    )
+    with atomic_output(f"results/{subreddit}/{filename}") as output:
+        render_final_video(
+            f"{workspace}/background.mp4",
+            overlays,
+            f"{workspace}/narration.m4a",
+            img_clip_pos,
+            new_opacity,
+            output,
+            workspace=workspace,
+        )
     ids = [a['thread_id'] for a in reddit_obj['items'][:number_of_clips]]
-    save_data_v2(subreddit, filename, filename, ids, background_config[2])
+    save_data_v2(subreddit, filename, filename, ids, background_config[2], int(reddit_obj['part']))
     # print_step("Removing temporary files 🗑")
-    cleanups = cleanup()
+    cleanups = cleanup(workspace)
     print_substep(f"Removed {cleanups} temporary files 🗑")
     print_substep("See result in the results folder!")
 
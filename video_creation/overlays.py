@@ -0,0 +1,31 @@
+from pathlib import Path
+
+from PIL import Image
+
+
+def prepare_overlay(image: str, width: int, opacity: float, workspace: str = "assets/temp") -> str:
+    """Returns a copy of a screenshot that is ready to be composited as is.
+
+    The copy is resized to the given width with the opacity folded into its alpha channel,
+    so renderers don't have to resample or build a mask for every frame.
+    It is written to the overlays folder of the job's workspace, which cleanup empties.
+    Args:
+        image (str): Path of the screenshot
+        width (int): Width the screenshot is displayed at
+        opacity (float): Opacity of the screenshot
+        workspace (str): Directory holding the temporary files of the current job
+
+    Returns:
+        str: Path of the prepared RGBA png
+    """
+    Path(f"{workspace}/overlays").mkdir(parents=True, exist_ok=True)
+    prepared = f"{workspace}/overlays/{Path(image).stem}-{width}.png"
+    with Image.open(image) as screenshot:
+        screenshot = screenshot.convert("RGBA")
+        height = round(screenshot.height * width / screenshot.width)
+        screenshot = screenshot.resize((width, height), Image.LANCZOS)
+    if opacity < 1:
+        alpha = screenshot.getchannel("A").point(lambda a: round(a * opacity))
+        screenshot.putalpha(alpha)
+    screenshot.save(prepared, format="PNG")
+    return prepared
@@ -0,0 +1,299 @@
+import math
+import shutil
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from reddit.async_fetch import configured_subreddits, iter_storymode_parts
+from reddit.subreddit import get_subreddit_threads
+from utils import settings
+from utils.cleanup import cleanup
+from utils.console import print_step, print_substep
+from utils.ratelimit import serve_rate_limiters, share_rate_limiters
+from utils.videos import allocate_part, release_part
+from video_creation.background import (
+    background_options,
+    chop_background_video,
+    download_background,
+    get_background_choice,
+    get_background_source,
+)
+from video_creation.final_video import make_final_video_v2
+from video_creation.screenshot_downloader import download_screenshots_of_reddit_posts
+from video_creation.voices import save_text_to_mp3
+
+
+class Stage(NamedTuple):
+    """A step of a job. func receives the results of all stages finished so far, keyed by name."""
+
+    name: str
+    func: Callable[[Dict[str, Any]], Any]
+    deps: List[str] = []
+
+
+def _timed(func: Callable[[Dict[str, Any]], Any], results: Dict[str, Any]):
+    start = perf_counter()
+    return func(results), perf_counter() - start
+
+
+def run_stages(stages: List[Stage]) -> Dict[str, Any]:
+    """Runs the stages of a job, each one in its own thread as soon as its dependencies are done.
+
+    Prints how long every stage took and how much wall-clock time running them concurrently saved.
+    Args:
+        stages (List[Stage]): The stages to run
+
+    Returns:
+        Dict[str, Any]: What every stage returned, keyed by name
+
+    Raises:
+        Exception: The first exception raised by a stage. Stages that are already running are
+            waited for, stages that haven't started yet are not started.
+    """
+    results, timings = {}, {}
+    pending, running = list(stages), {}
+    start = perf_counter()
+    with ThreadPoolExecutor(max_workers=len(stages)) as pool:
+        while pending or running:
+            for stage in [stage for stage in pending if all(dep in results for dep in stage.deps)]:
+                pending.remove(stage)
+                running[pool.submit(_timed, stage.func, dict(results))] = stage
+            if not running:
+                raise ValueError(f"Unsatisfiable stage dependencies: {[s.name for s in pending]}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                results[stage.name], timings[stage.name] = future.result()
+    wall_clock = perf_counter() - start
+
+    print_substep(
+        " | ".join(f"{name}: {seconds:.1f}s" for name, seconds in timings.items()), style="bold blue"
+    )
+    print_substep(
+        f"Stages took {wall_clock:.1f}s, {sum(timings.values()) - wall_clock:.1f}s less than one after another.",
+        style="bold blue",
+    )
+    return results
+
+
+def _preparation_stages(reddit_object: dict, bg_config: tuple, workspace: str) -> List[Stage]:
+    return [
+        Stage("tts", lambda _: save_text_to_mp3(reddit_object, workspace)),
+        # the number of posts that fit is only known after TTS, so every candidate is taken
+        Stage(
+            "screenshots",
+            lambda _: download_screenshots_of_reddit_posts(
+                reddit_object, len(reddit_object["items"]), workspace, show_progress=False
+            ),
+        ),
+        Stage(
+            "chop",
+            lambda r: chop_background_video(bg_config, math.ceil(r["tts"][0]), workspace),
+            ["tts"],
+        ),
+    ]
+
+
+def _render(reddit_object: dict, bg_config: tuple, workspace: str, results: Dict[str, Any]):
+    length, number_of_posts = results["tts"]
+    make_final_video_v2(number_of_posts + 1, math.ceil(length), reddit_object, bg_config, workspace)
+
+
+def run_job(reddit_object: dict, background_choice: str, workspace: str = "assets/temp"):
+    """Turns a storymode reddit object into a video: TTS, screenshots, background chop and render.
+
+    TTS and screenshots run concurrently, the background is chopped as soon as the length of the
+    audio is known and the render starts once all of them are done.
+    Args:
+        reddit_object (dict): Reddit object received from reddit/subreddit.py
+        background_choice (str): Key of the background in background_options
+        workspace (str): Directory holding the temporary files of this job
+    """
+    cleanup(workspace)
+    bg_config = background_options[background_choice]
+    run_stages(
+        _preparation_stages(reddit_object, bg_config, workspace)
+        + [
+            Stage(
+                "render",
+                lambda r: _render(reddit_object, bg_config, workspace, r),
+                ["tts", "screenshots", "chop"],
+            )
+        ]
+    )
+
+
+def prepare_background(background_choice: str):
+    """Downloads the background and builds its proxy so parallel jobs don't race to do it."""
+    bg_config = background_options[background_choice]
+    download_background(bg_config)
+    get_background_source(bg_config)
+
+
+def _init_worker(config: dict, limiters_address=None):
+    settings.config = config
+    if limiters_address is not None:
+        share_rate_limiters(limiters_address)
+
+
+def _run_isolated_job(reddit_object: dict, background_choice: str, workspace: str):
+    try:
+        run_job(reddit_object, background_choice, workspace)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+
+def storymode_parts(times: int) -> Iterator[Tuple[str, int, Optional[dict]]]:
+    """Yields the subreddit and allocated part number of each storymode part to make.
+
+    With several subreddits configured (e.g. "AskReddit+tifu") the parts take turns between
+    them, each counting its own parts, and every round of subreddits is fetched concurrently
+    (see reddit/async_fetch.py), so the contents come along. With one subreddit the contents
+    are None, fetch them with get_subreddit_threads. Release every part that isn't made.
+    """
+    subreddits = configured_subreddits()
+    if len(subreddits) > 1:
+        made = 0
+        for contents in iter_storymode_parts(subreddits, times):
+            yield contents["thread_subreddit"], int(contents["part"]), contents
+            made += 1
+        if made < times:
+            print_step("No subreddit has threads left.")
+        return
+    subreddit = settings.config["reddit"]["thread"]["subreddit"]
+    for _ in range(times):
+        yield subreddit, allocate_part(subreddit), None
+
+
+def run_jobs(times: int, workers: int):
+    """Makes times storymode videos with up to workers of them rendering at once.
+
+    Threads are fetched in this process, one job after another, so jobs never share a post and
+    part numbers are allocated in order (and given back if the job fails). Every job then runs in
+    its own process with its own workspace in assets/temp/job_<n>. Several subreddits take turns,
+    see storymode_parts. The rate limits of the TTS provider are shared by all jobs through a
+    manager process, so running jobs in parallel doesn't multiply them.
+    Args:
+        times (int): Number of videos to make
+        workers (int): Maximum number of jobs running at the same time
+    """
+    claimed = set()
+    # the TTS providers' limits hold for all jobs together, not for each job's process
+    limiters = serve_rate_limiters()
+    jobs, parts, allocated = {}, {}, []
+    try:
+        with limiters, ProcessPoolExecutor(
+            max_workers=workers, initializer=_init_worker, initargs=(settings.config, limiters.address)
+        ) as pool:
+            for i, (subreddit, part, reddit_object) in enumerate(storymode_parts(times)):
+                allocated.append((subreddit, part))
+                try:
+                    if reddit_object is None:
+                        reddit_object = get_subreddit_threads(
+                            None,
+                            part=str(part),
+                            post_type="top",
+                            time_filter="year",
+                            exclude=claimed,
+                        )
+                        claimed.update(item["thread_id"] for item in reddit_object["items"])
+                    background_choice = get_background_choice()
+                    prepare_background(background_choice)
+                except Exception as e:
+                    release_part(subreddit, part)
+                    print_step(f"ERROR WHILE PREPARING JOB {i}")
+                    print(e)
+                    continue
+                future = pool.submit(
+                    _run_isolated_job, reddit_object, background_choice, f"assets/temp/job_{i}"
+                )
+                jobs[future], parts[future] = i, (subreddit, part)
+                print_substep(f"Job {i} (part {reddit_object['part']}) queued.", style="bold blue")
+
+            for future in as_completed(jobs):
+                try:
+                    future.result()
+                    print_substep(f"Job {jobs[future]} finished.", style="bold green")
+                except Exception as e:
+                    release_part(*parts[future])
+                    print_step(f"ERROR AT JOB {jobs[future]}")
+                    print(e)
+    finally:
+        # also on Ctrl+C or a crash of this process, a no-op for the parts that were done
+        for subreddit, part in allocated:
+            release_part(subreddit, part)
+
+
+def run_pipelined(times: int, depth: int = 1):
+    """Makes times storymode videos, preparing the next ones while the current one renders.
+
+    A producer thread fetches threads, synthesizes audio, takes screenshots and chops the
+    background (network bound) and hands the prepared iterations to the renderer (CPU bound)
+    through a queue holding at most depth of them. Part numbers are allocated in order when
+    an iteration is fetched, since they are spoken in the intro, and given back if it fails.
+    Several subreddits take turns, see storymode_parts.
+    Args:
+        times (int): Number of videos to make
+        depth (int): How many prepared iterations may wait for the renderer
+    """
+    prepared = Queue(maxsize=depth)
+    allocated = []
+
+    def produce():
+        claimed = set()
+        try:
+            for i, (subreddit, part, reddit_object) in enumerate(storymode_parts(times)):
+                workspace = f"assets/temp/job_{i}"
+                allocated.append((subreddit, part))
+                try:
+                    if reddit_object is None:
+                        reddit_object = get_subreddit_threads(
+                            None,
+                            part=str(part),
+                            post_type="top",
+                            time_filter="year",
+                            exclude=claimed,
+                        )
+                        claimed.update(item["thread_id"] for item in reddit_object["items"])
+                    background_choice = get_background_choice()
+                    prepare_background(background_choice)
+                    bg_config = background_options[background_choice]
+                    cleanup(workspace)
+                    results = run_stages(_preparation_stages(reddit_object, bg_config, workspace))
+                except Exception as e:
+                    release_part(subreddit, part)
+                    print_step(f"ERROR WHILE PREPARING ITERATION {i}")
+                    print(e)
+                    shutil.rmtree(workspace, ignore_errors=True)
+                    continue
+                prepared.put((i, subreddit, part, reddit_object, bg_config, workspace, results))
+        finally:
+            prepared.put(None)
+
+    Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            job = prepared.get()
+            if job is None:
+                break
+            i, subreddit, part, reddit_object, bg_config, workspace, results = job
+            try:
+                _render(reddit_object, bg_config, workspace, results)
+            except Exception as e:
+                print_step(f"ERROR AT ITERATION {i} (part {reddit_object['part']})")
+                print(e)
+            finally:
+                release_part(subreddit, part)  # no-op once it's done
+                shutil.rmtree(workspace, ignore_errors=True)
+    finally:
+        # parts the producer allocated but that never got rendered, e.g. on Ctrl+C
+        for subreddit, part in allocated:
+            release_part(subreddit, part)
@@ -9,24 +9,33 @@ from playwright.async_api import async_playwright  # pylint: disable=unused-impo
 
 from playwright.sync_api import sync_playwright, ViewportSize
 from rich.progress import track
-import translators as ts
 from utils.subreddit import shouldSkip
 from utils.console import print_step, print_substep
+from utils.translation import prefetch, translate
 
 storymode = False
 
 
-def download_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: int):
-    """Downloads screenshots of reddit posts as seen on the web. Downloads to assets/temp/png
+def download_screenshots_of_reddit_posts(
+    reddit_object: dict,
+    screenshot_num: int,
+    workspace: str = "assets/temp",
+    show_progress: bool = True,
+):
+    """Downloads screenshots of reddit posts as seen on the web. Downloads to {workspace}/png
 
     Args:
         reddit_object (Dict): Reddit object received from reddit/subreddit.py
         screenshot_num (int): Number of screenshots to download
+        workspace (str): Directory holding the temporary files of the current job
+        show_progress (bool): Whether to show a progress bar. rich can only show one at a time,
+            so this has to be off while another stage is showing one.
     """
+    progress = track if show_progress else lambda sequence, description: sequence
     print_step("Downloading screenshots of reddit posts...")
 
     # ! Make sure the reddit screenshots folder exists
-    Path("assets/temp/png").mkdir(parents=True, exist_ok=True)
+    Path(f"{workspace}/png").mkdir(parents=True, exist_ok=True)
 
     with sync_playwright() as p:
         print_substep("Launching Headless Browser...")
@@ -41,8 +50,18 @@ def download_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: in
         cookies = json.loads(cookie_file.read())
         context.add_cookies(cookies)  # load preference cookies
         saved_subreddit_icon = False
+        lang = settings.config["reddit"]["thread"]["post_lang"]
         if settings.config["settings"]["storymode"]:
-            for idx, thread in track(enumerate(reddit_object['items']), "Taking screenshots..."):
+            # one request for every title that may be screenshotted, see utils.translation
+            prefetch(
+                [
+                    thread["thread_title"]
+                    for idx, thread in enumerate(reddit_object["items"])
+                    if idx <= screenshot_num and not shouldSkip(thread)
+                ],
+                lang,
+            )
+            for idx, thread in progress(enumerate(reddit_object['items']), "Taking screenshots..."):
                 if shouldSkip(thread):
                     continue
                 if idx > screenshot_num:
@@ -61,12 +80,9 @@ def download_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: in
 
                 # translate code
 
-                if settings.config["reddit"]["thread"]["post_lang"]:
+                if lang:
                     print_substep("Translating post...")
-                    texts_in_tl = ts.google(
-                        reddit_object["thread_title"],
-                        to_language=settings.config["reddit"]["thread"]["post_lang"],
-                    )
+                    texts_in_tl = translate(thread["thread_title"], lang)
 
                     page.evaluate(
                         "tl_content => document.querySelector('[data-test-id=\"post-content\"] > div:nth-child(3) > div > div').textContent = tl_content",
@@ -76,14 +92,19 @@ def download_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: in
                     print_substep("Skipping translation...")
                 if not saved_subreddit_icon:
                     page.locator('[alt="Subreddit Icon"]').last.screenshot(
-                        path="assets/temp/png/subreddit-icon.png")
+                        path=f"{workspace}/png/subreddit-icon.png")
                     saved_subreddit_icon = True
-                page.locator('[data-test-id="post-content"]').screenshot(path=f"assets/temp/png/title_{idx}.png")
+                page.locator('[data-test-id="post-content"]').screenshot(path=f"{workspace}/png/title_{idx}.png")
                 # if thread["thread_post"] != "":
                 #     page.locator('[data-click-id="text"]').screenshot(
-                #         path=f"assets/temp/png/content_{idx}.png"
+                #         path=f"{workspace}/png/content_{idx}.png"
                 #     )
         else:
+            prefetch(
+                [reddit_object["thread_title"]]
+                + [comment["comment_body"] for comment in reddit_object["comments"][:screenshot_num]],
+                lang,
+            )
             # Get the thread screenshot
             page = context.new_page()
             page.goto(reddit_object["thread_url"], timeout=0)
@@ -99,12 +120,9 @@ def download_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: in
 
             # translate code
 
-            if settings.config["reddit"]["thread"]["post_lang"]:
+            if lang:
                 print_substep("Translating post...")
-                texts_in_tl = ts.google(
-                    reddit_object["thread_title"],
-                    to_language=settings.config["reddit"]["thread"]["post_lang"],
-                )
+                texts_in_tl = translate(reddit_object["thread_title"], lang)
 
                 page.evaluate(
                     "tl_content => document.querySelector('[data-test-id=\"post-content\"] > div:nth-child(3) > div > div').textContent = tl_content",
@@ -114,17 +132,17 @@ def download_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: in
                 print_substep("Skipping translation...")
 
             page.locator('[alt="Subreddit Icon"] >> xpath=..').first.screenshot(
-                path="assets/temp/png/subreddit.png")
-            page.locator('[data-test-id="post-content"]').screenshot(path="assets/temp/png/title.png")
+                path=f"{workspace}/png/subreddit.png")
+            page.locator('[data-test-id="post-content"]').screenshot(path=f"{workspace}/png/title.png")
 
 
             if storymode:
                 page.locator('[data-click-id="text"]').screenshot(
-                    path="assets/temp/png/story_content.png"
+                    path=f"{workspace}/png/story_content.png"
                 )
             else:
                 for idx, comment in enumerate(
-                    track(reddit_object["comments"], "Downloading screenshots...")
+                    progress(reddit_object["comments"], "Downloading screenshots...")
                 ):
                     # Stop if we have reached the screenshot_num
                     if idx >= screenshot_num:
@@ -137,18 +155,15 @@ def download_screenshots_of_reddit_posts(reddit_object: dict, screenshot_num: in
 
                     # translate code
 
-                    if settings.config["reddit"]["thread"]["post_lang"]:
-                        comment_tl = ts.google(
-                            comment["comment_body"],
-                            to_language=settings.config["reddit"]["thread"]["post_lang"],
-                        )
+                    if lang:
+                        comment_tl = translate(comment["comment_body"], lang)
                         page.evaluate(
                             '([tl_content, tl_id]) => document.querySelector(`#t1_${tl_id} > div:nth-child(2) > div > div[data-testid="comment"] > div`).textContent = tl_content',
                             [comment_tl, comment["comment_id"]],
                         )
 
                     page.locator(f"#t1_{comment['comment_id']}").screenshot(
-                        path=f"assets/temp/png/comment_{idx}.png"
+                        path=f"{workspace}/png/comment_{idx}.png"
                     )
 
         print_substep("Screenshots downloaded Successfully.", style="bold green")
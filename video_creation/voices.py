@@ -9,6 +9,7 @@ from TTS.GTTS import GTTS
 from TTS.streamlabs_polly import StreamlabsPolly
 from TTS.aws_polly import AWSPolly
 from TTS.TikTok import TikTok
+from TTS.offline import OfflineTTS
 from utils import settings
 from utils.console import print_table, print_step
 
@@ -20,14 +21,16 @@ TTSProviders = {
     "AWSPolly": AWSPolly,
     "StreamlabsPolly": StreamlabsPolly,
     "TikTok": TikTok,
+    "Offline": OfflineTTS,
 }
 
 
-def save_text_to_mp3(reddit_obj) -> Tuple[int, int]:
-    """Saves text to MP3 files.
+def save_text_to_mp3(reddit_obj, workspace: str = "assets/temp") -> Tuple[int, int]:
+    """Saves text to MP3 files in {workspace}/mp3.
 
     Args:
         reddit_obj (): Reddit object received from reddit API in reddit/subreddit.py
+        workspace (str): Directory holding the temporary files of the current job
 
     Returns:
         tuple[int,int]: (total length of the audio, the number of comments audio was generated for)
@@ -35,7 +38,9 @@ def save_text_to_mp3(reddit_obj) -> Tuple[int, int]:
 
     voice = settings.config["settings"]["tts"]["choice"]
     if str(voice).casefold() in map(lambda _: _.casefold(), TTSProviders):
-        text_to_mp3 = TTSEngine(get_case_insensitive_key_value(TTSProviders, voice), reddit_obj)
+        text_to_mp3 = TTSEngine(
+            get_case_insensitive_key_value(TTSProviders, voice), reddit_obj, path=f"{workspace}/mp3"
+        )
     else:
         while True:
             print_step("Please choose one of the following TTS providers: ")
@@ -44,7 +49,9 @@ def save_text_to_mp3(reddit_obj) -> Tuple[int, int]:
             if choice.casefold() in map(lambda _: _.casefold(), TTSProviders):
                 break
             print("Unknown Choice")
-        text_to_mp3 = TTSEngine(get_case_insensitive_key_value(TTSProviders, choice), reddit_obj)
+        text_to_mp3 = TTSEngine(
+            get_case_insensitive_key_value(TTSProviders, choice), reddit_obj, path=f"{workspace}/mp3"
+        )
     return text_to_mp3.run()
 
 